@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -8,6 +9,127 @@ class Settings(BaseSettings):
     backend_url: str = "http://localhost:8081/"
     chat_active: bool = False
 
+    # Pool de conexiones a Redis
+    redis_max_connections: int = 50
+    redis_health_check_interval: int = 30
+    redis_socket_timeout: float = 5.0
+    redis_socket_connect_timeout: float = 2.0
+
+    # Compresión de valores grandes en Redis (historial, resumen, caché de herramientas):
+    # "none", "zlib" o "zstd" (requiere zstandard). El historial se guarda un mensaje por
+    # entrada y casi todos miden menos de 1 KB, así que el umbral debe ser bajo
+    storage_compression: str = "zlib"
+    storage_compression_threshold: int = 256
+    storage_compression_level: int = 3
+
+    # Memoización de respuestas a preguntas repetidas que solo dependen del pensum (opt-in)
+    response_cache_enabled: bool = False
+    response_cache_ttl: int = 3600
+    response_cache_max_entries: int = 512
+
+    # Ventana de historial enviada al modelo
+    history_token_budget: int = 6000
+    history_recent_turns: int = 6
+    # Máximo de turnos que se leen de Redis para armar la ventana
+    history_max_loaded_turns: int = 40
+    history_summary_enabled: bool = True
+    summary_model_name: Optional[str] = None
+
+    # Presupuesto de tiempo de un turno, repartido entre sus rondas con el modelo
+    turn_deadline_seconds: float = 90.0
+    # Timeout de cada ronda (en streaming: hasta el primer chunk y entre chunks)
+    model_round_timeout: float = 30.0
+    # Hedging: duplicar la ronda si tarda más que el percentil de las latencias recientes
+    model_hedge_enabled: bool = False
+    model_hedge_quantile: float = 0.95
+    model_hedge_min_delay: float = 1.0
+    # Modelo de respaldo cuando el principal está sobrecargado (429/503) o no responde a tiempo
+    fallback_model_name: Optional[str] = None
+
+    # Context caching de Gemini para el prefijo estático (prompt + herramientas)
+    gemini_context_cache: bool = False
+    gemini_context_cache_ttl: int = 3600
+    # Segundos de espera antes de reintentar crear el caché tras un fallo
+    gemini_context_cache_retry: int = 300
+
+    # Pool de conexiones HTTP hacia el backend de horarios
+    backend_max_connections: int = 100
+    backend_max_keepalive_connections: int = 20
+    backend_keepalive_expiry: float = 30.0
+    backend_timeout: float = 15.0
+    backend_connect_timeout: float = 5.0
+    backend_http2: bool = False
+
+    # Ejecución de function calls dentro de una misma ronda del modelo
+    tool_max_concurrency: int = 4
+    tool_parallel_mutations: bool = False
+    # Proyección/compactación de resultados de herramientas antes de enviarlos al modelo
+    tool_result_compaction: bool = True
+    # Operaciones independientes de apply_schedule_changes que se envían a la vez al backend
+    schedule_batch_concurrency: int = 4
+
+    # Lectura anticipada de herramientas en paralelo con la primera ronda del modelo:
+    # "off", "first_turn" (sesión sin historial) o "always"
+    prefetch_mode: str = "off"
+    prefetch_tools: List[str] = ["get_pensum", "get_schedule"]
+
+    # Caché de resultados de get_pensum / get_schedule (segundos)
+    tool_cache_enabled: bool = True
+    tool_cache_max_entries: int = 1024
+    pensum_cache_ttl: int = 3600
+    schedule_cache_ttl: int = 300
+    # Vida máxima en la memoria del proceso del horario, para acotar datos obsoletos entre workers
+    schedule_cache_local_ttl: int = 5
+
+    # Un solo turno a la vez por sesión (lease en Redis, válido entre workers)
+    session_lock_enabled: bool = True
+    # "queue": esperar el turno en curso; "reject": responder 409
+    session_lock_policy: str = "queue"
+    session_lock_ttl: float = 30.0
+    session_lock_wait_timeout: float = 120.0
+    # Mensajes idénticos simultáneos en la misma sesión comparten un solo turno
+    request_coalescing: bool = True
+
+    # Registro de eventos de cada turno en streaming (Redis stream) para reanudar con Last-Event-ID
+    turn_event_log_enabled: bool = True
+    turn_event_ttl: int = 300
+    turn_event_max_len: int = 5000
+    # Segundos sin eventos nuevos tras los que se abandona el seguimiento de un turno reanudado
+    turn_resume_idle_timeout: float = 30.0
+
+    # Control de admisión de turnos del modelo
+    admission_control_enabled: bool = True
+    # Token bucket por usuario (Redis, compartido entre réplicas); 0 = sin límite.
+    # De mejor esfuerzo: se identifica por el hash del JWT, sin verificar la firma
+    user_rate_limit_per_minute: float = 20
+    user_rate_limit_burst: int = 5
+    # Token bucket del proceso; 0 = sin límite
+    process_rate_limit_per_second: float = 20
+    process_rate_limit_burst: int = 40
+    # Turnos simultáneos por proceso y cola de espera acotada
+    max_inflight_turns: int = 32
+    admission_queue_size: int = 64
+    admission_queue_timeout: float = 10.0
+
+    # Logging estructurado (cola + hilo escritor)
+    log_level: str = "INFO"
+    # Niveles por logger, p. ej. LOG_LEVELS='{"app.service.chat": "DEBUG"}'
+    log_levels: Dict[str, str] = {}
+    log_json: bool = True
+    log_queue_size: int = 10000
+    # Largo máximo de cada campo de texto en un registro
+    log_max_field_chars: int = 2000
+    # Fracción de payloads grandes (candidates, resultados de herramientas) que se registran en DEBUG
+    log_payload_sample_rate: float = 0.1
+
+    # Arranque: precarga del SDK, pools de Redis/HTTP y config del modelo antes de recibir tráfico
+    warmup_enabled: bool = True
+    # JWT de una cuenta de servicio para precargar su pensum (abre también las conexiones al backend)
+    warmup_jwt: Optional[str] = None
+    # /ready: segundos que se reutiliza el último chequeo de dependencias y timeout de cada chequeo
+    ready_cache_ttl: float = 2.0
+    ready_check_timeout: float = 1.0
+
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
@@ -1,22 +1,55 @@
-from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, Depends, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .service.chat_service import chat_service
+from contextlib import asynccontextmanager
+from .service.chat_service import chat_service, parse_event_id
+from .service.backend_service import backend_service
+from .service.cache_service import tool_cache
+from .service.response_cache import response_cache
+from .service.chat import gemini_runtime
+from .service.redis_service import redis_service
+from .service.session_lock import SessionBusyError
+from .service.admission import AdmissionError, admission_controller
+from .service.codec import sse_event
+from .service.logging_service import logging_service
+from .service.readiness import readiness_service
+from .service.metrics import FIRST_BYTE_SECONDS, TraceMiddleware, get_trace_id, stats_collector
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from .models import (
     CreateSessionResponse,
     SendMessageRequest,
     SendMessageResponse,
     ListSessionsResponse,
 )
+import logging
 import warnings
 from app.config import get_settings
-import json
+import time
 
 
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
 warnings.filterwarnings("ignore", message=".*pydantic.*")
 
-app = FastAPI(title="Gemini Chat API", version="1.0.0")
+# Logging estructurado sin bloquear el event loop (cola + hilo escritor)
+logging_service.setup()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging_service.setup()
+    # SDK de Gemini, config del modelo y pools de Redis y HTTP (compartidos durante toda la vida del proceso)
+    await readiness_service.warmup()
+    try:
+        await redis_service.migrate_legacy_sessions()
+    except Exception as e:
+        # Sin Redis el proceso arranca igual; /ready lo reporta y la migración se repite en el próximo arranque
+        logger.warning("Migración de sesiones del formato anterior falló: %s", e)
+    yield
+    await backend_service.shutdown()
+    await redis_service.close()
+    logging_service.shutdown()
+
+app = FastAPI(title="Gemini Chat API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,7 +57,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
+app.add_middleware(TraceMiddleware)
+
+# Los contadores que ya llevan los servicios se exportan también en /metrics
+stats_collector.register("backend_pool", backend_service.get_pool_stats)
+stats_collector.register("tool_cache", tool_cache.get_stats)
+stats_collector.register("context_cache", gemini_runtime.get_stats)
+stats_collector.register("response_cache", response_cache.get_stats)
+stats_collector.register("logging", logging_service.get_stats)
+stats_collector.register("admission", admission_controller.get_stats)
+
+def use_response_cache(request: Request) -> bool:
+    """Permite saltarse la caché de respuestas con `X-Cache-Bypass: 1` o `Cache-Control: no-cache`"""
+    bypass = request.headers.get("X-Cache-Bypass", "").lower() in ("1", "true", "yes")
+    no_cache = "no-cache" in request.headers.get("Cache-Control", "").lower()
+    return not (bypass or no_cache)
 
 async def get_jwt_token(request: Request) -> str:
     """Dependency para extraer y verificar JWT token"""
@@ -39,63 +88,125 @@ async def get_jwt_token(request: Request) -> str:
     return auth_header[7:]
 
 @app.post("/chat/session", response_model=CreateSessionResponse)
-def create_session(payload: CreateSessionResponse, token: str = Depends(get_jwt_token)):
+async def create_session(payload: CreateSessionResponse, token: str = Depends(get_jwt_token)):
     try:
-        sid = chat_service.create_session(payload.session_id)
+        sid = await chat_service.create_session(payload.session_id)
         return CreateSessionResponse(session_id=sid)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/chat/sessions", response_model=ListSessionsResponse)
-def list_sessions():
-    return ListSessionsResponse(sessions=chat_service.list_sessions())
+async def list_sessions(offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    sessions = await chat_service.list_sessions(offset, limit)
+    next_offset = offset + limit if len(sessions) == limit else None
+    return ListSessionsResponse(sessions=sessions, next_offset=next_offset)
 
 @app.post("/chat/message", response_model=SendMessageResponse)
-def send_message(payload: SendMessageRequest, token: str = Depends(get_jwt_token)):
+async def send_message(payload: SendMessageRequest, token: str = Depends(get_jwt_token), use_cache: bool = Depends(use_response_cache)):
     if not get_settings().chat_active:
         raise HTTPException(status_code=503, detail='Actualmente el chatbot no está activo, por favor inténtalo después')
 
     try:
         
-        reply = chat_service.send_message(payload.session_id, payload.message)
+        reply = await chat_service.send_message(payload.session_id, payload.message, token, use_cache)
         return SendMessageResponse(session_id=payload.session_id, reply=reply)
     except KeyError:
         raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_response(events, start: float) -> StreamingResponse:
+    """Respuesta SSE; `events` None significa que el chatbot está desactivado"""
+    async def event_generator():
+        if events is None:
+            yield sse_event({'type': 'error', 'message': 'Actualmente el chatbot no está activo, por favor inténtalo después', 'trace_id': get_trace_id()})
+        else:
+            first_byte = True
+            try:
+                async for chunk in events:
+                    if first_byte:
+                        first_byte = False
+                        FIRST_BYTE_SECONDS.observe(time.perf_counter() - start)
+                    yield chunk
+            except Exception as e:
+                yield sse_event({'type': 'error', 'message': str(e), 'trace_id': get_trace_id()})
+
+    return StreamingResponse(
+        event_generator(), 
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
+async def resume_stream(turn_id: str, last_seq: int, token: str, start: float) -> StreamingResponse:
+    try:
+        events = await chat_service.resume_message_stream(turn_id, last_seq, token)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="El turno no existe o ya expiró")
+    return sse_response(events, start)
+
 @app.post("/chat/stream")
-def stream_message(payload: SendMessageRequest, token: str = Depends(get_jwt_token)):
+async def stream_message(request: Request, payload: SendMessageRequest, token: str = Depends(get_jwt_token), use_cache: bool = Depends(use_response_cache)):
     """Endpoint para streaming con SSE"""
+    start = time.perf_counter()
+    # Reconexión del cliente: se continúa el turno anterior en lugar de enviar el mensaje otra vez
+    last_event = parse_event_id(request.headers.get("Last-Event-ID"))
+    if last_event is not None and get_settings().turn_event_log_enabled:
+        return await resume_stream(*last_event, token, start)
     try:
         # Verificar que la sesión existe o crearla
 
-        sessions = chat_service.list_sessions()
-        if payload.session_id not in sessions:
-            chat_service.create_session(payload.session_id)
-
-        def event_generator():
-            if not get_settings().chat_active:
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Actualmente el chatbot no está activo, por favor inténtalo después'})}\n\n"
-            else:
-                try:
-                    for chunk in chat_service.send_message_stream(payload.session_id, payload.message, token):
-                        yield chunk
-                except Exception as e:
-                    yield f"data: {{\"type\": \"error\", \"message\": \"{str(e)}\"}}\n\n"
-
-        return StreamingResponse(
-            event_generator(), 
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-            }
-        )
+        if not await chat_service.session_exists(payload.session_id):
+            await chat_service.create_session(payload.session_id)
+
+        # El turno arranca antes de abrir el stream para poder responder 409 si la sesión está ocupada
+        events = None
+        if get_settings().chat_active:
+            events = await chat_service.open_message_stream(payload.session_id, payload.message, token, use_cache)
+        return sse_response(events, start)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/chat/stream/{turn_id}")
+async def resume_message_stream(turn_id: str, request: Request, last_event_id: int = Query(0), token: str = Depends(get_jwt_token)):
+    """Reanudar un turno en streaming; sin Last-Event-ID se reenvía completo"""
+    last_event = parse_event_id(request.headers.get("Last-Event-ID"))
+    last_seq = last_event[1] if last_event is not None and last_event[0] == turn_id else last_event_id
+    return await resume_stream(turn_id, last_seq, token, time.perf_counter())
+
+# async para no depender del threadpool: sigue respondiendo aunque esté saturado
 @app.get("/health")
-def health():
-    return {"status": "ok"}
\ No newline at end of file
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Listo para recibir tráfico: warmup terminado y Redis y backend respondiendo"""
+    result = await readiness_service.check()
+    return JSONResponse(result, status_code=200 if result["ready"] else 503)
+
+@app.get("/stats")
+def stats():
+    return {
+        "backend_pool": backend_service.get_pool_stats(),
+        "tool_cache": tool_cache.get_stats(),
+        "context_cache": gemini_runtime.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "admission": admission_controller.get_stats(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class CreateSessionResponse(BaseModel):
     session_id: int = Field(..., description="ID único de la sesión")
@@ -14,6 +14,7 @@ class SendMessageResponse(BaseModel):
 
 class ListSessionsResponse(BaseModel):
     sessions: List[int]
+    next_offset: Optional[int] = Field(None, description="Offset de la siguiente página, None si no hay más")
 
 class ErrorResponse(BaseModel):
     detail: str
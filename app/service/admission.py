@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from app.config import get_settings
+from .auth import get_user_id
+from .metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+from .redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionError(Exception):
+    """Petición rechazada por límite de tasa (429) o por falta de capacidad (503)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class TokenBucket:
+    """Token bucket local (por proceso)"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consumir un token; devuelve 0 si se pudo o los segundos hasta el próximo"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TurnSlot:
+    """Cupo de un turno en curso; se devuelve con `release()` al terminar"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.started)
+
+
+class AdmissionController:
+    """
+    Control de admisión de turnos del modelo:
+    - Token bucket por usuario en Redis (compartido entre réplicas). Es de mejor esfuerzo:
+      la identidad es el hash del JWT, cuya firma aquí no se verifica, así que otro token
+      obtiene otro bucket; el límite que no se puede evadir es el del proceso
+    - Token bucket del proceso
+    - Máximo de turnos simultáneos con una cola de espera acotada
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        self.process_bucket = TokenBucket(settings.process_rate_limit_per_second, settings.process_rate_limit_burst)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Duración media de un turno (EWMA), para estimar Retry-After
+        self._turn_seconds = 5.0
+
+    def _reject(self, reason: str, status_code: int, detail: str, retry_after: float) -> AdmissionError:
+        ADMISSION_REJECTIONS.labels(reason=reason).inc()
+        return AdmissionError(status_code, detail, retry_after)
+
+    async def _check_user_rate(self, jwt: str):
+        settings = get_settings()
+        if settings.user_rate_limit_per_minute <= 0:
+            return
+        try:
+            allowed, retry_after = await redis_service.take_rate_token(
+                f"ratelimit:user:{get_user_id(jwt)}",
+                settings.user_rate_limit_per_minute / 60,
+                settings.user_rate_limit_burst,
+            )
+        except Exception as e:
+            # Sin Redis no se bloquea a los usuarios: quedan los límites del proceso
+            logger.warning("Rate limit por usuario no disponible: %s", e)
+            return
+        if not allowed:
+            raise self._reject("user_rate", 429, "Demasiados mensajes, espera un momento antes de enviar otro", retry_after)
+
+    def _check_process_rate(self):
+        if get_settings().process_rate_limit_per_second <= 0:
+            return
+        retry_after = self.process_bucket.take()
+        if retry_after:
+            raise self._reject("process_rate", 503, "Servicio con mucha carga, inténtalo de nuevo en unos segundos", retry_after)
+
+    def _estimated_wait(self) -> float:
+        max_turns = max(1, get_settings().max_inflight_turns)
+        return self._turn_seconds * (len(self._waiters) + 1) / max_turns
+
+    async def _acquire_slot(self) -> TurnSlot:
+        settings = get_settings()
+        if self.in_flight < settings.max_inflight_turns and not self._waiters:
+            self.in_flight += 1
+            return TurnSlot(self)
+
+        if len(self._waiters) >= settings.admission_queue_size:
+            raise self._reject("queue_full", 503, "Servicio con mucha carga, inténtalo de nuevo en unos segundos", self._estimated_wait())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, settings.admission_queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # El cupo llegó justo al vencer la espera: devolverlo
+                self._release(None)
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject("queue_timeout", 503, "Servicio con mucha carga, inténtalo de nuevo en unos segundos", self._estimated_wait())
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start)
+        # El cupo se transfiere tal cual desde el turno que terminó (in_flight no cambia)
+        return TurnSlot(self)
+
+    def _release(self, turn_seconds: Optional[float]):
+        if turn_seconds is not None:
+            self._turn_seconds = 0.8 * self._turn_seconds + 0.2 * turn_seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def admit(self, jwt: str) -> Optional[TurnSlot]:
+        """
+        Admitir un turno nuevo o lanzar AdmissionError (429 límite del usuario, 503 capacidad).
+        Devuelve el cupo a liberar cuando el turno termine (None si el control está desactivado).
+        """
+        if not get_settings().admission_control_enabled:
+            return None
+        await self._check_user_rate(jwt)
+        self._check_process_rate()
+        return await self._acquire_slot()
+
+    def get_stats(self) -> Dict[str, float]:
+        return {"in_flight": self.in_flight, "queue_depth": len(self._waiters)}
+
+
+admission_controller = AdmissionController()
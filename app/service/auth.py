@@ -0,0 +1,12 @@
+import hashlib
+
+
+def get_user_id(jwt: str) -> str:
+    """
+    Obtener una identidad ligada a la credencial: hash del JWT completo.
+    Aquí no se verifica la firma (de eso se encarga el backend), así que no se
+    confía en los claims del payload: un token con el `sub` de otro usuario y
+    una firma inválida produce una identidad distinta y no comparte sus cachés,
+    su límite de peticiones ni sus turnos.
+    """
+    return hashlib.sha256(jwt.encode("utf-8")).hexdigest()[:32]
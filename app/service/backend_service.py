@@ -1,82 +1,254 @@
 from app.config import get_settings
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+import asyncio
+import logging
 import httpx
 
+from .auth import get_user_id
+from .cache_service import tool_cache
+
+logger = logging.getLogger(__name__)
+
+# Orden de las fases de apply_schedule_changes: primero se liberan franjas y luego se ocupan
+ACTION_PHASES = {"delete": 0, "change": 1, "add": 2}
+
 
 class BackendService:
     def __init__(self):
         settings = get_settings()
         self.backend_url = settings.backend_url
+        self._client: Optional[httpx.AsyncClient] = None
+        # Contadores de reutilización del pool: hit = conexión reutilizada, miss = conexión nueva
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        settings = get_settings()
+        return httpx.AsyncClient(
+            http2=settings.backend_http2,
+            limits=httpx.Limits(
+                max_connections=settings.backend_max_connections,
+                max_keepalive_connections=settings.backend_max_keepalive_connections,
+                keepalive_expiry=settings.backend_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                settings.backend_timeout,
+                connect=settings.backend_connect_timeout,
+            ),
+        )
+
+    async def startup(self):
+        """Crear el cliente HTTP compartido (se llama al iniciar FastAPI)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+
+    async def shutdown(self):
+        """Cerrar el cliente HTTP compartido y sus conexiones"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def ping(self, timeout: float) -> bool:
+        """El backend responde (cualquier status menor a 500 cuenta como disponible)"""
+        response = await self.client.get(self.backend_url, timeout=timeout)
+        return response.status_code < 500
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Creación perezosa por si se usa el servicio fuera del ciclo de vida de FastAPI
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    def get_pool_stats(self) -> Dict[str, int]:
+        """Estadísticas de reutilización de conexiones"""
+        return {"hits": self.pool_hits, "misses": self.pool_misses}
+
+    async def _request(self, method: str, endpoint: str, jwt: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
+        url = f"{self.backend_url}{endpoint}"
+        logger.debug("%s %s", method, url)
+
+        new_connection = False
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            nonlocal new_connection
+            if event_name == "connection.connect_tcp.started":
+                new_connection = True
+
+        response = await self.client.request(
+            method,
+            url,
+            headers={
+                "Authorization": f"Bearer {jwt}"
+            },
+            json=data,
+            extensions={"trace": trace},
+        )
+
+        if new_connection:
+            self.pool_misses += 1
+        else:
+            self.pool_hits += 1
+
+        response.raise_for_status()
+        return response.json()
 
     async def _get(self, endpoint: str, jwt: str) -> Dict[str, Any]:
-        async with httpx.AsyncClient() as client:
-            url = f"{self.backend_url}{endpoint}"
-            print(f"GET {url}")
-            response = await client.get(
-                url,
-                headers={
-                    "Authorization": f"Bearer {jwt}"
-                },
-            )
-            response.raise_for_status()
-            return response.json()
-    
+        return await self._request("GET", endpoint, jwt)
+
     async def _post(self, endpoint: str, jwt: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
-        async with httpx.AsyncClient() as client:
-            url = f"{self.backend_url}{endpoint}"
-            print(f"POST {url}")
-            response = await client.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {jwt}"
-                },
-                json=data
-            )
-            response.raise_for_status()
-            return response.json()
-        
+        return await self._request("POST", endpoint, jwt, data)
+
     async def _put(self, endpoint: str, jwt: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
-        async with httpx.AsyncClient() as client:
-            url = f"{self.backend_url}{endpoint}"
-            print(f"PUT {url}")
-            response = await client.put(
-                url,
-                headers={
-                    "Authorization": f"Bearer {jwt}"
-                },
-                json=data
-            )
-            response.raise_for_status()
-            return response.json()
-    
+        return await self._request("PUT", endpoint, jwt, data)
+
     async def _delete(self, endpoint: str, jwt: str) -> Dict[str, Any]:
-        async with httpx.AsyncClient() as client:
-            url = f"{self.backend_url}{endpoint}"
-            print(f"DELETE {url}")
-            response = await client.delete(
-                url,
-                headers={
-                    "Authorization": f"Bearer {jwt}"
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+        return await self._request("DELETE", endpoint, jwt)
+
+    def _pensum_key(self, jwt: str) -> str:
+        return f"pensum:{get_user_id(jwt)}"
+
+    def _schedule_key(self, jwt: str, schedule_id: int) -> str:
+        return f"schedule:{get_user_id(jwt)}:{schedule_id}"
+
+    async def invalidate_schedule(self, jwt: str, schedule_id: int):
+        """Descartar el horario cacheado tras una modificación"""
+        await tool_cache.invalidate(self._schedule_key(jwt, schedule_id))
 
     async def get_pensum(self, jwt: str, **kwargs) -> Dict[str, Any]:
-        return await self._get("pensum", jwt)
+        settings = get_settings()
+        if not settings.tool_cache_enabled:
+            return await self._get("pensum", jwt)
+
+        return await tool_cache.get_or_load(
+            self._pensum_key(jwt),
+            settings.pensum_cache_ttl,
+            lambda: self._get("pensum", jwt),
+        )
     
     async def get_schedule(self, jwt: str, schedule_id: int, **kwargs) -> Dict[str, Any]:
-        return await self._get(f"schedule/{schedule_id}", jwt)
+        settings = get_settings()
+        if not settings.tool_cache_enabled:
+            return await self._get(f"schedule/{schedule_id}", jwt)
+
+        return await tool_cache.get_or_load(
+            self._schedule_key(jwt, schedule_id),
+            settings.schedule_cache_ttl,
+            lambda: self._get(f"schedule/{schedule_id}", jwt),
+            local_ttl=settings.schedule_cache_local_ttl,
+        )
 
     async def add_group(self,  jwt: str, schedule_id: int, group_code: str, **kwargs) -> Dict[str, Any]:
-        return await self._post(f"schedule/{schedule_id}/group/{group_code}", jwt)
+        try:
+            return await self._post(f"schedule/{schedule_id}/group/{group_code}", jwt)
+        finally:
+            await self.invalidate_schedule(jwt, schedule_id)
 
     async def delete_group(self, jwt: str, schedule_id: int, group_code: str, **kwargs) -> Dict[str, Any]:
-        return await self._delete(f"schedule/{schedule_id}/group/{group_code}", jwt)
+        try:
+            return await self._delete(f"schedule/{schedule_id}/group/{group_code}", jwt)
+        finally:
+            await self.invalidate_schedule(jwt, schedule_id)
 
     async def change_group(self, jwt: str, schedule_id: int, old_group_code: str, new_group_code: str, **kwargs) -> Dict[str, Any]:
-        return await self._put(f"schedule/{schedule_id}/group/{old_group_code}", jwt, {
-            "newCode": new_group_code
-        })
+        try:
+            return await self._put(f"schedule/{schedule_id}/group/{old_group_code}", jwt, {
+                "newCode": new_group_code
+            })
+        finally:
+            await self.invalidate_schedule(jwt, schedule_id)
+
+    async def _apply_operation(self, jwt: str, schedule_id: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        action = operation.get("action")
+        group_code = operation.get("group_code")
+        if not group_code:
+            raise ValueError("Falta group_code")
+        if action == "add":
+            return await self._post(f"schedule/{schedule_id}/group/{group_code}", jwt)
+        if action == "delete":
+            return await self._delete(f"schedule/{schedule_id}/group/{group_code}", jwt)
+        if action == "change":
+            if not operation.get("new_group_code"):
+                raise ValueError("Falta new_group_code")
+            return await self._put(f"schedule/{schedule_id}/group/{group_code}", jwt, {
+                "newCode": operation["new_group_code"]
+            })
+        raise ValueError(f"Acción inválida: {action}")
+
+    def _plan_operation_phases(self, operations: List[Dict[str, Any]]) -> List[List[List[int]]]:
+        """
+        Ordenar las operaciones en fases: primero delete, luego change y al final add, para que
+        lo que libera franjas llegue al backend antes de lo que las ocupa. Dentro de cada fase
+        se agrupan en cadenas por materia (ver _plan_operation_chains).
+        """
+        phases: Dict[int, List[int]] = {}
+        for i, operation in enumerate(operations):
+            phases.setdefault(ACTION_PHASES.get(operation.get("action"), len(ACTION_PHASES)), []).append(i)
+        return [
+            [[indices[i] for i in chain] for chain in self._plan_operation_chains([operations[i] for i in indices])]
+            for _, indices in sorted(phases.items())
+        ]
+
+    def _plan_operation_chains(self, operations: List[Dict[str, Any]]) -> List[List[int]]:
+        """
+        Agrupar operaciones dependientes (mismas materias) en cadenas que se ejecutan en orden;
+        cadenas distintas son independientes entre sí.
+        """
+        parent = list(range(len(operations)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        owner: Dict[str, int] = {}
+        for i, operation in enumerate(operations):
+            codes = [operation.get("group_code"), operation.get("new_group_code")]
+            # El código de materia es el prefijo del código de grupo ('1155503-A' -> '1155503')
+            for subject in {str(code).split("-")[0] for code in codes if code}:
+                if subject in owner:
+                    parent[find(i)] = find(owner[subject])
+                else:
+                    owner[subject] = i
+
+        chains: Dict[int, List[int]] = {}
+        for i in range(len(operations)):
+            chains.setdefault(find(i), []).append(i)
+        return list(chains.values())
+
+    async def apply_schedule_changes(self, jwt: str, schedule_id: int, operations: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """
+        Aplicar varias operaciones add/delete/change en una sola llamada.
+        Las independientes de una misma fase se ejecutan en paralelo; el horario final se consulta una sola vez.
+        """
+        settings = get_settings()
+        operations = [dict(operation) for operation in operations]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(operations)
+        semaphore = asyncio.Semaphore(max(1, settings.schedule_batch_concurrency))
+
+        async def run_chain(chain: List[int]):
+            async with semaphore:
+                for i in chain:
+                    result = {"index": i, **operations[i]}
+                    try:
+                        await self._apply_operation(jwt, schedule_id, operations[i])
+                        result["ok"] = True
+                    except httpx.HTTPStatusError as e:
+                        result.update(ok=False, error=e.response.text)
+                    except Exception as e:
+                        result.update(ok=False, error=str(e))
+                    results[i] = result
+
+        try:
+            for phase in self._plan_operation_phases(operations):
+                await asyncio.gather(*[run_chain(chain) for chain in phase])
+        finally:
+            await self.invalidate_schedule(jwt, schedule_id)
+
+        return {
+            "results": results,
+            "schedule": await self.get_schedule(jwt, schedule_id),
+        }
 
-backend_service = BackendService()
\ No newline at end of file
+backend_service = BackendService()
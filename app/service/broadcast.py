@@ -0,0 +1,50 @@
+import asyncio
+from typing import AsyncGenerator, Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TurnBroadcast(Generic[T]):
+    """
+    Eventos de un turno en curso que pueden seguir varios suscriptores.
+    Quien se une tarde recibe primero los eventos ya emitidos y luego los nuevos.
+    """
+
+    def __init__(self):
+        self.events: List[T] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.subscribers = 0
+
+    def publish(self, event: T):
+        self.events.append(event)
+        self._wake()
+
+    def close(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncGenerator[T, None]:
+        self.subscribers += 1
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+    async def result(self) -> T:
+        """Último evento publicado (para turnos sin streaming)"""
+        async for _ in self.subscribe():
+            pass
+        return self.events[-1]
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import get_settings
+from .codec import get_codec
+from .redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCache:
+    """
+    Caché de dos niveles para resultados del backend:
+    - LRU en memoria del proceso (respuestas sin ir a la red)
+    - Redis compartido entre workers/réplicas
+    """
+
+    def __init__(self, prefix: str = "cache", max_entries: Optional[int] = None):
+        settings = get_settings()
+        self.prefix = prefix
+        self.max_entries = max_entries or settings.tool_cache_max_entries
+        self._local: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            "hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _get_local(self, key: str) -> Optional[Any]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._local[key]
+            self.stats["expirations"] += 1
+            return None
+        self._local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: Any, ttl: float):
+        self._local[key] = (time.monotonic() + ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get(self, key: str, local_ttl: Optional[float] = None) -> Optional[Any]:
+        """Buscar primero en memoria y luego en Redis"""
+        value = self._get_local(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+
+        try:
+            raw = await redis_service.client.get(self._redis_key(key))
+        except Exception as e:
+            logger.warning("Cache Redis no disponible: %s", e)
+            raw = None
+
+        if raw is None:
+            self.stats["misses"] += 1
+            return None
+
+        value = get_codec().decode(raw)
+        if local_ttl:
+            self._set_local(key, value, local_ttl)
+        self.stats["redis_hits"] += 1
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int, local_ttl: Optional[float] = None):
+        """Guardar en ambos niveles; el nivel local puede vivir menos para acotar datos obsoletos entre workers"""
+        self._set_local(key, value, min(ttl, local_ttl) if local_ttl else ttl)
+        try:
+            await redis_service.client.set(self._redis_key(key), get_codec().encode(value), ex=ttl)
+        except Exception as e:
+            logger.warning("Cache Redis no disponible: %s", e)
+
+    async def invalidate(self, key: str):
+        """
+        Eliminar una llave de ambos niveles. Una carga en curso de la llave deja de
+        compartirse y su resultado no se guarda: pudo leer el valor anterior al cambio.
+        """
+        self._local.pop(key, None)
+        self._inflight.pop(key, None)
+        self.stats["invalidations"] += 1
+        try:
+            await redis_service.client.delete(self._redis_key(key))
+        except Exception as e:
+            logger.warning("Cache Redis no disponible: %s", e)
+
+    async def get_or_load(self, key: str, ttl: int, loader: Callable[[], Awaitable[Any]], local_ttl: Optional[float] = None) -> Any:
+        """
+        Devolver el valor cacheado o cargarlo con `loader`.
+        Las cargas concurrentes de la misma llave comparten una sola petición.
+        """
+        value = await self.get(key, local_ttl=local_ttl or ttl)
+        if value is not None:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Si la carga original fue cancelada, esta petición carga por su cuenta
+                if not inflight.cancelled():
+                    raise
+                return await loader()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+            # Si la llave se invalidó mientras cargaba, el valor puede estar obsoleto
+            if self._inflight.get(key) is future:
+                await self.set(key, value, ttl, local_ttl=local_ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar "exception was never retrieved" cuando nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "size": len(self._local)}
+
+
+tool_cache = ToolCache()
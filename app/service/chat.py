@@ -1,47 +1,61 @@
+from __future__ import annotations
+
 from app.config import get_settings
 
 import asyncio
-
-import google.genai as genai
-from google.genai import types
+import importlib
+import logging
 
 from .backend_service import backend_service
+from .compaction import compact_tool_result
+from . import schedule_engine
+from .metrics import MODEL_FALLBACKS, MODEL_ROUNDS, STAGE_SECONDS, TOOL_CALL_SECONDS, record_usage, stage
+from .model_calls import TurnDeadline, hedge_delay, latency_tracker, overload_reason, run_hedged
+from .logging_service import Truncated, sampled
 
 import os
 
 import httpx
 
-from typing import Generator, Dict, Any, Callable, Coroutine
+from typing import TYPE_CHECKING, AsyncGenerator, Awaitable, Dict, Any, Callable, Coroutine, List, Optional, Tuple
+import hashlib
 import inspect
+import time
+
+if TYPE_CHECKING:
+    import google.genai as genai
+    from google.genai import types
+
+logger = logging.getLogger(__name__)
 
 max_iterations = 10  # Prevenir bucles infinitos
 
 
-def get_prompt():
+def genai_module():
+    """
+    google-genai se importa en el primer uso: sus tipos tardan segundos en cargar y
+    alargan el arranque de cada réplica. El lifespan lo precarga (ver GeminiRuntime.warmup).
+    """
+    return importlib.import_module("google.genai")
+
+
+def genai_types():
+    return importlib.import_module("google.genai.types")
+
+
+def get_prompt_path() -> str:
     # Obtener la ruta del directorio donde está este archivo
     current_dir = os.path.dirname(os.path.abspath(__file__))
     root_dir = os.path.dirname(
         os.path.dirname(current_dir)
     )  # Sube 2 niveles: service -> app -> ai-assistant
-    prompt_path = os.path.join(root_dir, "prompt.txt")
+    return os.path.join(root_dir, "prompt.txt")
 
-    with open(prompt_path, "r", encoding="utf-8") as file:
-        return file.read()
 
+def get_prompt():
+    with open(get_prompt_path(), "r", encoding="utf-8") as file:
+        return file.read()
 
-def async_to_sync_wrapper(async_func: Callable[..., Coroutine]):
-    """
-    Convierte una función async en una callable síncrona segura para threads.
-    - Usa el event loop actual si existe (AnyIO/uvicorn)
-    - Crea y ejecuta un loop nuevo si está en un worker sin loop
-    """
-    def sync_wrapper(*args, **kwargs):
-        try:
-            loop = asyncio.get_running_loop()
-            return asyncio.run_coroutine_threadsafe(async_func(*args, **kwargs), loop).result()
-        except RuntimeError:
-            return asyncio.run(async_func(*args, **kwargs))
-    return sync_wrapper
 
 def create_backend_tool(async_method: Callable[..., Coroutine], required_keys: Dict[str, type]):
     """
@@ -49,12 +63,11 @@ def create_backend_tool(async_method: Callable[..., Coroutine], required_keys: D
     - Recibe el contexto por llamada (no se guarda estado)
     - Valida llaves requeridas
     - Filtra solo parámetros aceptados por la firma del método destino
-    - Ejecuta la corrutina de forma segura en entorno sync
+    - Espera la corrutina directamente en el event loop de la app
     """
-    sync_method = async_to_sync_wrapper(async_method)
     allowed_params = set(inspect.signature(async_method).parameters.keys())
 
-    def tool(context: Dict[str, Any] = None, **tool_args):
+    async def tool(context: Dict[str, Any] = None, **tool_args):
         if context is None:
             raise ValueError("Context requerido")
 
@@ -75,7 +88,7 @@ def create_backend_tool(async_method: Callable[..., Coroutine], required_keys: D
         filtered = {k: v for k, v in merged.items() if k in allowed_params}
 
         try:
-            return sync_method(**filtered)
+            return await async_method(**filtered)
         except httpx.HTTPStatusError as e:
             return e.response.text
 
@@ -90,26 +103,36 @@ add_group_tool = create_backend_tool(backend_service.add_group, {"jwt": str, "gr
 delete_group_tool = create_backend_tool(backend_service.delete_group, {"jwt": str, "group_code": str})
 # ia-afanador: change_group usa old_group_code y new_group_code
 change_group_tool = create_backend_tool(backend_service.change_group, {"jwt": str, "old_group_code": str, "new_group_code": str})
+apply_schedule_changes_tool = create_backend_tool(backend_service.apply_schedule_changes, {"jwt": str, "operations": list})
+# Motor local de cruces y prerrequisitos sobre los datos cacheados (no modifica el backend)
+check_schedule_options_tool = create_backend_tool(schedule_engine.check_schedule_options, {"jwt": str})
+
+async def get_pensum(context: Dict[str, Any], **kwargs):
+    return await pensum_tool(context, **kwargs)
 
-def get_pensum(context: Dict[str, Any], **kwargs):
-    return pensum_tool(context, **kwargs)
+async def get_schedule(context: Dict[str, Any], **kwargs):
+    return await schedule_tool(context, **kwargs)
 
-def get_schedule(context: Dict[str, Any], **kwargs):
-    return schedule_tool(context, **kwargs)
+async def add_group(context: Dict[str, Any], **kwargs):
+    return await add_group_tool(context, **kwargs)
 
-def add_group(context: Dict[str, Any], **kwargs):
-    return add_group_tool(context, **kwargs)
+async def delete_group(context: Dict[str, Any], **kwargs):
+    return await delete_group_tool(context, **kwargs)
 
-def delete_group(context: Dict[str, Any], **kwargs):
-    return delete_group_tool(context, **kwargs)
+async def change_group(context: Dict[str, Any], **kwargs):
+    return await change_group_tool(context, **kwargs)
 
-def change_group(context: Dict[str, Any], **kwargs):
-    return change_group_tool(context, **kwargs)
+async def apply_schedule_changes(context: Dict[str, Any], **kwargs):
+    return await apply_schedule_changes_tool(context, **kwargs)
+
+async def check_schedule_options(context: Dict[str, Any], **kwargs):
+    return await check_schedule_options_tool(context, **kwargs)
 
 
 TOOLS = {
     "get_pensum": {
         "function": get_pensum,
+        "read_only": True,
         "tool": {
             "name": "get_pensum",
             "description": "Retrieve the complete curriculum, including all available courses and subjects, along with the user's progress.",
@@ -118,6 +141,7 @@ TOOLS = {
     },
     "get_schedule": {
         "function": get_schedule,
+        "read_only": True,
         "tool": {
             "name": "get_schedule",
             "description": "Retrieve the user's current draft schedule, including all added subjects and groups.",
@@ -129,6 +153,7 @@ TOOLS = {
     },
     "add_group": {
         "function": add_group,
+        "read_only": False,
         "tool": {
             "name": "add_group",
             "description": "Adds a specific subject group to the user's draft schedule. Returns the updated schedule.",
@@ -146,6 +171,7 @@ TOOLS = {
     },
     "delete_group": {
         "function": delete_group,
+        "read_only": False,
         "tool": {
             "name": "delete_group",
             "description": "Remove a group from the schedule draft. This also removes the associated subject. Returns the updated schedule.",
@@ -163,6 +189,7 @@ TOOLS = {
     },
     "change_group": {
         "function": change_group,
+        "read_only": False,
         "tool": {
             "name": "change_group",
             "description": "Change a group in the schedule draft to another group. Returns the updated schedule.",
@@ -182,49 +209,412 @@ TOOLS = {
             },
         },
     },
+    "apply_schedule_changes": {
+        "function": apply_schedule_changes,
+        "read_only": False,
+        "tool": {
+            "name": "apply_schedule_changes",
+            "description": "Apply several changes to the user's draft schedule in a single call (preferred over many add_group/delete_group/change_group calls). Deletes run first, then changes, then adds, so freeing a slot and filling it works in one call; independent operations within each step run in parallel. Returns the success or error of each operation and the final schedule once.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "operations": {
+                        "type": "array",
+                        "description": "Operations to apply. They are reordered: all deletes run first, then all changes, then all adds. Within each of those steps, operations on the same subject keep the given order and run sequentially, and operations on different subjects may run in parallel.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "action": {
+                                    "type": "string",
+                                    "enum": ["add", "delete", "change"],
+                                    "description": "add: add group_code; delete: remove group_code; change: replace group_code with new_group_code."
+                                },
+                                "group_code": {
+                                    "type": "string",
+                                    "description": "The group to add or delete, or the current group to replace (e.g., '1155503-A')."
+                                },
+                                "new_group_code": {
+                                    "type": "string",
+                                    "description": "Only for change: the new group to assign (e.g., '1155503-B')."
+                                }
+                            },
+                            "required": ["action", "group_code"]
+                        }
+                    }
+                },
+                "required": ["operations"]
+            },
+        },
+    },
+    "check_schedule_options": {
+        "function": check_schedule_options,
+        "read_only": True,
+        "tool": {
+            "name": "check_schedule_options",
+            "description": "Check locally, without modifying anything, which groups fit the user's current draft schedule. Given a subject_code, lists every group of that subject with its time slots, whether it is compatible and which enrolled groups it overlaps; compatible is null when the time slots could not be read, so confirm those with get_schedule. Given a group_code, checks that single group. Also reports whether the subject's prerequisites are met. Use it before add_group or change_group to avoid trial and error.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "subject_code": {
+                        "type": "string",
+                        "description": "The code of the subject whose groups should be checked (e.g., '1155503')."
+                    },
+                    "group_code": {
+                        "type": "string",
+                        "description": "The code of a single group to check (e.g., '1155503-A')."
+                    }
+                }
+            },
+        },
+    },
 }
 
 
-class Chat:
-    def __init__(self, chat_history):
+async def _execute_function_call(function_call, context: Dict[str, Any]) -> Tuple[Any, Optional[str]]:
+    """Ejecuta una function call y devuelve (part de respuesta, error)"""
+    function_name = function_call.name
+    start = time.perf_counter()
+    try:
+        fc_args = getattr(function_call, "args", {}) or {}
+        logger.info("Ejecutando %s", function_name, extra={"tool": function_name, "tool_args": Truncated(fc_args)})
+        prefetch = context.get("prefetch")
+        prefetched = False
+        if prefetch is not None:
+            if not TOOLS[function_name]["read_only"]:
+                prefetch.discard()
+            elif not fc_args:
+                prefetched, function_result = await prefetch.take(function_name)
+        if not prefetched:
+            function_result = await TOOLS[function_name]["function"](context, **fc_args)
+        if get_settings().tool_result_compaction:
+            function_result = compact_tool_result(function_name, function_result)
+        if logger.isEnabledFor(logging.DEBUG) and sampled():
+            logger.debug("Resultado de %s: %s", function_name, Truncated(function_result), extra={"tool": function_name})
+        TOOL_CALL_SECONDS.labels(tool=function_name, status="ok").observe(time.perf_counter() - start)
+        return genai_types().Part.from_function_response(
+            name=function_name,
+            response={"content": function_result}
+        ), None
+    except Exception as e:
+        logger.warning("Error en %s: %s", function_name, e, extra={"tool": function_name})
+        TOOL_CALL_SECONDS.labels(tool=function_name, status="error").observe(time.perf_counter() - start)
+        return genai_types().Part.from_function_response(
+            name=function_name,
+            response={"error": str(e)}
+        ), str(e)
+
+
+def _plan_batches(function_calls: List[Any], parallel_mutations: bool) -> List[List[int]]:
+    """
+    Agrupa los índices de las function calls en lotes que se ejecutan uno tras otro:
+    - Las llamadas de solo lectura consecutivas comparten lote (concurrentes)
+    - Cada mutación va en su propio lote para respetar el orden pedido por el modelo
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for i, function_call in enumerate(function_calls):
+        if parallel_mutations or TOOLS[function_call.name].get("read_only", False):
+            current.append(i)
+            continue
+        if current:
+            batches.append(current)
+            current = []
+        batches.append([i])
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def execute_function_calls(function_calls: List[Any], context: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Ejecuta las function calls de una ronda con concurrencia limitada.
+    Emite un evento "started" por llamada al lanzarla y uno "completed" a medida
+    que cada una termina; el índice permite reconstruir el orden original.
+    """
+    settings = get_settings()
+    semaphore = asyncio.Semaphore(max(1, settings.tool_max_concurrency))
+    known_calls = [fc for fc in function_calls if fc.name in TOOLS]
+
+    async def run(index: int):
+        async with semaphore:
+            part, error = await _execute_function_call(known_calls[index], context)
+        return index, part, error
+
+    for batch in _plan_batches(known_calls, settings.tool_parallel_mutations):
+        for index in batch:
+            yield {"status": "started", "index": index, "total": len(known_calls), "function_name": known_calls[index].name}
+
+        tasks = [asyncio.create_task(run(index)) for index in batch]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                index, part, error = await finished
+                yield {
+                    "status": "completed",
+                    "index": index,
+                    "function_name": known_calls[index].name,
+                    "part": part,
+                    "error": error,
+                }
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+
+class GeminiRuntime:
+    """
+    Estado del modelo compartido por todo el proceso:
+    - Cliente de Gemini (y su pool de conexiones)
+    - Texto del prompt, recargado si prompt.txt cambia en disco (mtime)
+    - GenerateContentConfig con las declaraciones de herramientas
+    Solo el historial de cada sesión se construye por petición.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._tool = None
+        self._prompt = None
+        self._prompt_mtime = None
+        self.prompt_hash = ""
+        self._config = None
+        # Context caching: nombre del cached content y momento en que expira
+        self._cache_name: Optional[str] = None
+        self._cache_expires_at = 0.0
+        self._cache_retry_at = 0.0
+        self._cache_lock = asyncio.Lock()
+        self.context_cache_stats = {"created": 0, "refreshed": 0, "reused": 0, "fallbacks": 0}
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            settings = get_settings()
+            if not settings.gemini_api_key:
+                raise ValueError("GEMINI_API_KEY no configurada")
+            self._client = genai_module().Client(api_key=settings.gemini_api_key)
+        return self._client
+
+    @property
+    def tool(self) -> types.Tool:
+        if self._tool is None:
+            self._tool = genai_types().Tool(
+                function_declarations=[TOOLS[tool]["tool"] for tool in TOOLS]
+            )
+        return self._tool
+
+    def get_prompt(self) -> str:
+        """Prompt del sistema; se vuelve a leer solo si el archivo cambió"""
+        mtime = os.stat(get_prompt_path()).st_mtime_ns
+        if self._prompt is None or mtime != self._prompt_mtime:
+            self._prompt = get_prompt()
+            self._prompt_mtime = mtime
+            self.prompt_hash = hashlib.sha256(self._prompt.encode("utf-8")).hexdigest()[:16]
+            self._config = None
+            # El cached content contiene el prompt anterior: hay que recrearlo
+            self._cache_expires_at = 0.0
+        return self._prompt
+
+    def get_config(self) -> types.GenerateContentConfig:
+        prompt = self.get_prompt()
+        if self._config is None:
+            self._config = genai_types().GenerateContentConfig(
+                system_instruction=prompt,
+                tools=[self.tool],
+            )
+        return self._config
+
+    async def get_chat_config(self) -> types.GenerateContentConfig:
+        """
+        Config para crear un chat. Con context caching activo referencia el
+        cached content del prefijo estático; si no está disponible usa la
+        config completa.
+        """
         settings = get_settings()
-        if not settings.gemini_api_key:
-            raise ValueError("GEMINI_API_KEY no configurada")
-        model_name = settings.model_name
-        self.client = genai.Client(api_key=settings.gemini_api_key)
-        self.last_response = ""
+        config = self.get_config()
+        if not settings.gemini_context_cache:
+            return config
+
+        cache_name = await self._get_cached_content()
+        if cache_name is None:
+            self.context_cache_stats["fallbacks"] += 1
+            return config
 
-        gemini_history = []
-        for msg in chat_history:
-            gemini_history.append(
-                types.Content(
-                    role=msg["role"], parts=[types.Part.from_text(text=msg["content"])]
+        return genai_types().GenerateContentConfig(cached_content=cache_name)
+
+    async def _get_cached_content(self) -> Optional[str]:
+        settings = get_settings()
+        ttl = settings.gemini_context_cache_ttl
+        now = time.monotonic()
+
+        # Se renueva a mitad del TTL para no usar nunca un caché a punto de expirar
+        if self._cache_name and now < self._cache_expires_at - ttl / 2:
+            self.context_cache_stats["reused"] += 1
+            return self._cache_name
+        if now < self._cache_retry_at:
+            return None
+
+        async with self._cache_lock:
+            now = time.monotonic()
+            if self._cache_name and now < self._cache_expires_at - ttl / 2:
+                self.context_cache_stats["reused"] += 1
+                return self._cache_name
+
+            prompt = self.get_prompt()
+
+            if self._cache_name and now < self._cache_expires_at:
+                try:
+                    await self.client.aio.caches.update(
+                        name=self._cache_name,
+                        config=genai_types().UpdateCachedContentConfig(ttl=f"{ttl}s"),
+                    )
+                    self._cache_expires_at = now + ttl
+                    self.context_cache_stats["refreshed"] += 1
+                    logger.info("Context cache renovado: %s", self._cache_name)
+                    return self._cache_name
+                except Exception as e:
+                    logger.warning("No se pudo renovar el context cache %s: %s", self._cache_name, e)
+
+            try:
+                cached = await self.client.aio.caches.create(
+                    model=settings.model_name,
+                    config=genai_types().CreateCachedContentConfig(
+                        display_name="horario-assistant-prefix",
+                        system_instruction=prompt,
+                        tools=[self.tool],
+                        ttl=f"{ttl}s",
+                    ),
                 )
+            except Exception as e:
+                # Modelo sin soporte, prompt por debajo del mínimo de tokens, cuota, etc.
+                logger.warning("Context cache no disponible, se usa la config completa: %s", e)
+                self._cache_name = None
+                self._cache_retry_at = now + settings.gemini_context_cache_retry
+                return None
+
+            previous = self._cache_name
+            self._cache_name = cached.name
+            self._cache_expires_at = now + ttl
+            self.context_cache_stats["created"] += 1
+            logger.info("Context cache creado: %s", self._cache_name)
+
+        if previous and previous != self._cache_name:
+            try:
+                await self.client.aio.caches.delete(name=previous)
+            except Exception:
+                pass
+
+        return self._cache_name
+
+    def warmup(self):
+        """
+        Importar el SDK y construir el cliente, el prompt y la config del modelo.
+        Es bloqueante (import y lectura del prompt): el lifespan lo corre en un hilo.
+        """
+        genai_types()
+        if get_settings().gemini_api_key:
+            self.client
+        self.get_config()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.context_cache_stats, "cache_name": self._cache_name}
+
+
+gemini_runtime = GeminiRuntime()
+
+
+class Chat:
+    def __init__(self, chat_history, config: types.GenerateContentConfig | None = None):
+        settings = get_settings()
+        self.client = gemini_runtime.client
+        self.last_response = ""
+        # Herramientas llamadas durante el último mensaje (para decidir si la respuesta es memoizable)
+        self.called_tools: List[str] = []
+        self.tool_errors = 0
+        # Modelo en uso; cambia al de respaldo si el principal falla durante el turno
+        self.model = settings.model_name
+        self.config = config or gemini_runtime.get_config()
+        self.deadline = TurnDeadline(settings.turn_deadline_seconds)
+
+        types = genai_types()
+        gemini_history = [
+            types.Content(
+                role=msg["role"], parts=[types.Part.from_text(text=msg["content"])]
             )
+            for msg in chat_history
+        ]
 
-        self.chat = self.client.chats.create(
-            model=model_name,
-            config=types.GenerateContentConfig(
-                system_instruction=get_prompt(),
-                tools=[
-                    types.Tool(
-                        function_declarations=[TOOLS[tool]["tool"] for tool in TOOLS]
-                    )
-                ],
-            ),
+        self.chat = self.client.aio.chats.create(
+            model=self.model,
+            config=self.config,
             history=gemini_history,
         )
 
+    @classmethod
+    async def create(cls, chat_history) -> "Chat":
+        """Crear un chat usando el context cache cuando está habilitado"""
+        with stage("chat_build"):
+            return cls(chat_history, await gemini_runtime.get_chat_config())
+
+    def _fork_chat(self, model: str):
+        """Chat nuevo con el mismo historial, para el hedging o el modelo de respaldo"""
+        # El context cache está atado al modelo principal: el de respaldo usa la config completa
+        config = self.config if model == self.model else gemini_runtime.get_config()
+        return self.client.aio.chats.create(model=model, config=config, history=self.chat.get_history())
+
+    async def _call_model(self, kind: str, send: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        Una ronda con el modelo: `send(chat)` con timeout (acotado por el presupuesto del turno),
+        hedging opcional y reintento con el modelo de respaldo si el principal está sobrecargado.
+        El chat que responde queda como `self.chat` para las rondas siguientes.
+        """
+        settings = get_settings()
+        timeout = self.deadline.round_timeout(settings.model_round_timeout)
+        MODEL_ROUNDS.labels(model=self.model).inc()
+        start = time.perf_counter()
+        hedge_chat = None
+
+        def hedge():
+            nonlocal hedge_chat
+            hedge_chat = self._fork_chat(self.model)
+            return send(hedge_chat)
+
+        try:
+            result, hedged = await run_hedged(lambda: send(self.chat), hedge, hedge_delay(self.model, kind), timeout)
+        except Exception as e:
+            reason = overload_reason(e)
+            fallback = settings.fallback_model_name
+            if reason is None or not fallback or fallback == self.model:
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self.deadline.timeout_error() from e
+                raise
+            logger.warning("Modelo %s no disponible (%s: %s), se usa %s", self.model, reason, str(e) or type(e).__name__, fallback)
+            MODEL_FALLBACKS.labels(reason=reason).inc()
+            self.chat = self._fork_chat(fallback)
+            self.model = fallback
+            MODEL_ROUNDS.labels(model=self.model).inc()
+            try:
+                return await asyncio.wait_for(send(self.chat), self.deadline.round_timeout(settings.model_round_timeout))
+            except asyncio.TimeoutError as timeout_error:
+                raise self.deadline.timeout_error() from timeout_error
+
+        latency_tracker.observe(self.model, kind, time.perf_counter() - start)
+        if hedged:
+            self.chat = hedge_chat
+        return result
+
     def get_last_response(self) -> str:
         """Obtener la última respuesta"""
         return self.last_response
 
-    def send_message(self, msg: str, context: Dict[str, Any] | None = None):
-        response = self.chat.send_message(msg)
+    async def send_message(self, msg: str, context: Dict[str, Any] | None = None):
+        self.deadline = TurnDeadline(get_settings().turn_deadline_seconds)
+        with stage("model_round"):
+            response = await self._call_model("message", lambda chat: chat.send_message(msg))
+        record_usage(response.usage_metadata)
         iteration = 0
 
         while iteration < max_iterations:
-            print(f"Iteration {iteration + 1}: {response.candidates}")
+            if logger.isEnabledFor(logging.DEBUG) and sampled():
+                logger.debug("Iteración %d: %s", iteration + 1, Truncated(response.candidates))
             
             # Buscar todas las function calls en todos los parts
             function_calls = []
@@ -236,145 +626,163 @@ class Chat:
             if not function_calls:
                 break
 
-            # Procesar todos los function calls encontrados
-            all_results = []
-            
-            for function_call in function_calls:
-                function_name = function_call.name
-                print(f"Function to call: {function_name}")
-                
-                if function_name in TOOLS:
-                    try:
-                        fc_args = getattr(function_call, "args", {}) or {}
-                        function_result = TOOLS[function_name]["function"](context or {}, **fc_args)
-                        
-                        all_results.append(
-                            types.Part.from_function_response(
-                                name=function_name, 
-                                response={"content": function_result}
-                            )
-                        )
-                    except Exception as e:
-                        print(f"Error en {function_name}: {e}")
-                        all_results.append(
-                            types.Part.from_function_response(
-                                name=function_name, 
-                                response={"error": str(e)}
-                            )
-                        )
+            # Procesar todos los function calls encontrados (en paralelo cuando es seguro)
+            results: Dict[int, Any] = {}
+            async for event in execute_function_calls(function_calls, context or {}):
+                if event["status"] == "started":
+                    self.called_tools.append(event["function_name"])
+                    continue
+                results[event["index"]] = event["part"]
+                if event["error"]:
+                    self.tool_errors += 1
+
+            all_results = [results[i] for i in sorted(results)]
 
             # Enviar todos los resultados de vuelta al modelo para la siguiente iteración
             if all_results:
-                response = self.chat.send_message(all_results)
+                with stage("model_round"):
+                    response = await self._call_model("message", lambda chat: chat.send_message(all_results))
+                record_usage(response.usage_metadata)
                 iteration += 1
             else:
                 break
 
         if iteration >= max_iterations:
-            print(f"Warning: Reached max iterations ({max_iterations})")
+            logger.warning("Alcanzado el máximo de iteraciones (%d)", max_iterations)
 
         self.last_response = response.text if response.text else ""
         return self.last_response
 
-    def send_message_stream(self, msg: str, context: Dict) -> Generator[Dict[str, Any], None, None]:
-        """Envía mensaje con streaming de eventos"""
+    @staticmethod
+    async def _open_stream(chat, message) -> Tuple[Any, Any]:
+        """Iniciar el stream de una ronda y esperar su primer chunk"""
+        stream = (await chat.send_message_stream(message)).__aiter__()
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+
+    async def _next_chunk(self, stream) -> Any:
+        timeout = self.deadline.round_timeout(get_settings().model_round_timeout)
+        try:
+            return await asyncio.wait_for(stream.__anext__(), timeout)
+        except StopAsyncIteration:
+            return None
+        except asyncio.TimeoutError as e:
+            raise self.deadline.timeout_error() from e
+
+    async def _stream_round(self, message) -> AsyncGenerator[Any, None]:
+        """
+        Envía un mensaje con la API de streaming del modelo y emite cada part
+        (texto o function call) a medida que llega.
+        El stream se consume completo para que el SDK registre el turno en el historial.
+        """
+        start = time.perf_counter()
+        usage_metadata = None
+        # El timeout, el hedging y el respaldo cubren hasta el primer chunk; después se sigue con ese stream
+        stream, chunk = await self._call_model("stream", lambda chat: self._open_stream(chat, message))
+        while chunk is not None:
+            # El uso de tokens llega acumulado; vale el del último chunk que lo trae
+            usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+            if chunk.candidates and chunk.candidates[0].content:
+                for part in chunk.candidates[0].content.parts or []:
+                    yield part
+            chunk = await self._next_chunk(stream)
+        record_usage(usage_metadata)
+        STAGE_SECONDS.labels(stage="model_round").observe(time.perf_counter() - start)
+
+    async def send_message_stream(self, msg: str, context: Dict) -> AsyncGenerator[Dict[str, Any], None]:
+        """Envía mensaje con streaming de eventos y del texto generado (eventos delta)"""
         yield {"type": "message_start", "message": "Enviando mensaje..."}
+        self.deadline = TurnDeadline(get_settings().turn_deadline_seconds)
 
-        response = self.chat.send_message(msg)
         max_iterations = 5  # Prevenir bucles infinitos
         iteration = 0
         total_functions_executed = 0
+        message = msg
+        response_parts: List[str] = []
 
-        while iteration < max_iterations:
-            # Buscar todas las function calls en todos los parts
+        while True:
+            # Buscar function calls en el stream; el texto se reenvía apenas llega
             function_calls = []
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_calls.append(part.function_call)
+            try:
+                async for part in self._stream_round(message):
+                    if getattr(part, 'function_call', None):
+                        function_calls.append(part.function_call)
+                    elif part.text and not getattr(part, 'thought', False):
+                        response_parts.append(part.text)
+                        yield {"type": "delta", "content": part.text}
+            except Exception as e:
+                if iteration == 0:
+                    raise
+                yield {
+                    "type": "error",
+                    "message": f"Error generando respuesta: {str(e)}"
+                }
+                self.last_response = "Error procesando respuesta"
+                return
 
             # Si no hay function calls, terminar el bucle
             if not function_calls:
                 break
 
-            # Procesar todos los function calls encontrados
-            all_results = []
-            
-            for i, function_call in enumerate(function_calls):
-                function_name = function_call.name
-                total_functions_executed += 1
-                
+            if iteration >= max_iterations:
                 yield {
-                    "type": "function_call",
-                    "function_name": function_name,
-                    "message": f"Ronda {iteration + 1} - Ejecutando función {i+1}/{len(function_calls)}: {function_name}",
+                    "type": "error", 
+                    "message": f"Alcanzado límite máximo de {max_iterations} rondas de funciones"
                 }
+                break
+
+            # Procesar todos los function calls encontrados (en paralelo cuando es seguro)
+            results: Dict[int, Any] = {}
 
-                if function_name in TOOLS:
+            async for event in execute_function_calls(function_calls, context):
+                function_name = event["function_name"]
+
+                if event["status"] == "started":
+                    total_functions_executed += 1
+                    self.called_tools.append(function_name)
+                    yield {
+                        "type": "function_call",
+                        "function_name": function_name,
+                        "message": f"Ronda {iteration + 1} - Ejecutando función {event['index'] + 1}/{event['total']}: {function_name}",
+                    }
                     yield {
                         "type": "function_executing",
                         "message": f"Cargando {function_name}...",
                     }
+                    continue
 
-                    try:
-                        fc_args = getattr(function_call, "args", {}) or {}
-                        print(f"Iteration {iteration + 1}: Executing {function_name}{fc_args}")
-                        function_result = TOOLS[function_name]["function"](context, **fc_args)
-                        
-                        all_results.append(
-                            types.Part.from_function_response(
-                                name=function_name, 
-                                response={"content": function_result}
-                            )
-                        )
-
-                        yield {
-                            "type": "function_completed",
-                            "function_name": function_name,
-                            "message": f"Función {function_name} completada",
-                        }
-
-                    except Exception as e:
-                        yield {
-                            "type": "error",
-                            "message": f"Error en {function_name}: {str(e)}"
-                        }
-                        all_results.append(
-                            types.Part.from_function_response(
-                                name=function_name, 
-                                response={"error": str(e)}
-                            )
-                        )
-
-            # Enviar todos los resultados de vuelta al modelo para la siguiente iteración
-            if all_results:
-                yield {
-                    "type": "generating_response",
-                    "message": f"Procesando resultados de ronda {iteration + 1}...",
-                }
-
-                try:
-                    response = self.chat.send_message(all_results)
-                    iteration += 1
-                except Exception as e:
+                results[event["index"]] = event["part"]
+                if event["error"]:
+                    self.tool_errors += 1
                     yield {
                         "type": "error",
-                        "message": f"Error generando respuesta: {str(e)}"
+                        "message": f"Error en {function_name}: {event['error']}"
                     }
-                    self.last_response = "Error procesando respuesta"
-                    return
-            else:
+                else:
+                    yield {
+                        "type": "function_completed",
+                        "function_name": function_name,
+                        "message": f"Función {function_name} completada",
+                    }
+
+            all_results = [results[i] for i in sorted(results)]
+            if not all_results:
                 break
 
-        if iteration >= max_iterations:
+            # Enviar todos los resultados de vuelta al modelo para la siguiente iteración
             yield {
-                "type": "error", 
-                "message": f"Alcanzado límite máximo de {max_iterations} rondas de funciones"
+                "type": "generating_response",
+                "message": f"Procesando resultados de ronda {iteration + 1}...",
             }
+            message = all_results
+            iteration += 1
 
-        self.last_response = response.text if response.text else ""
+        self.last_response = "".join(response_parts)
 
         yield {
             "type": "response",
             "content": self.last_response,
             "message": "Respuesta generada",
-        }
\ No newline at end of file
+        }
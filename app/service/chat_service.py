@@ -1,21 +1,56 @@
-from typing import List, Generator
+from typing import Any, Callable, List, AsyncGenerator, Optional, Dict, Set, Tuple
+from app.config import get_settings
 from .redis_service import redis_service
-from .chat import Chat
-import json
+from .summary_service import summary_service
+from .response_cache import response_cache, is_memoizable, normalize_message
+from .tokens import estimate_message_tokens, estimate_tokens
+from .chat import Chat, TOOLS
+from .prefetch import Prefetch
+from .codec import sse_event, with_event_id
+from .auth import get_user_id
+from .broadcast import TurnBroadcast
+from .session_lock import SessionBusyError, SessionLease
+from .admission import admission_controller
+from .metrics import COALESCED_TURNS, FIRST_TOKEN_SECONDS, SESSION_LOCK_EVENTS, TURN_RESUMES, TURN_SECONDS, get_trace_id, stage, timed
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Espera máxima de cada XREAD al seguir un turno reanudado (debe ser menor que el socket_timeout de Redis)
+RESUME_BLOCK_MS = 1000
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Last-Event-ID con la forma "{turn_id}:{seq}" -> (turn_id, seq)"""
+    if not value or ":" not in value:
+        return None
+    turn_id, _, seq = value.strip().rpartition(":")
+    if not turn_id or not seq.isdigit():
+        return None
+    return turn_id, int(seq)
 
 class ChatService:
     def __init__(self):
-        pass
+        # Turnos en curso por (endpoint, sesión, usuario, mensaje normalizado)
+        self._inflight: Dict[Tuple, TurnBroadcast] = {}
+        # Resultado de la admisión de los turnos registrados que todavía no arrancan
+        self._admitting: Dict[Tuple, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
 
-    def create_session(self, session_id: int) -> int:
-        # Crear historial vacío en Redis
-        redis_service.set_chat_history(session_id, [])
-        redis_service.add_session(session_id)
+    async def create_session(self, session_id: int) -> int:
+        # Crear historial vacío y registrar la sesión en Redis
+        await redis_service.create_session(session_id)
 
         return session_id
 
-    def list_sessions(self) -> List[int]:
-        return [int(x) for x in redis_service.get_sessions()]
+    async def list_sessions(self, offset: int = 0, limit: Optional[int] = None) -> List[int]:
+        return [int(x) for x in await redis_service.get_sessions(offset, limit)]
+
+    async def session_exists(self, session_id: int) -> bool:
+        return await redis_service.session_exists(session_id)
 
     def _serialize_message_content(self, content):
         """Convert Gemini Content objects to simple text"""
@@ -33,73 +68,397 @@ class ChatService:
         else:
             return str(content)
 
-    def _get_chat_from_history(self, session_id: int):
-        """Crear objeto chat desde el historial guardado"""
-        history = redis_service.get_chat_history(session_id)
-        if history is None:
-            self.create_session(session_id)
-            history = redis_service.get_chat_history(session_id)
+    def _apply_token_budget(self, entries: List[Dict], start: int, summary: Dict) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Elegir los mensajes que verá el modelo.
+        Devuelve (mensajes visibles, índice absoluto hasta el que hay que plegar en el resumen o None).
+        """
+        settings = get_settings()
+        covered = summary.get("covered", 0)
+        # Descartar lo que ya está incluido en el resumen
+        unsummarized = entries[max(0, covered - start):]
+        first_index = max(start, covered)
+
+        budget = settings.history_token_budget - estimate_tokens(summary.get("summary", ""))
+        if estimate_message_tokens(unsummarized) <= budget and first_index == covered:
+            return unsummarized, None
+
+        # Solo los últimos N turnos, recortando los más antiguos si aún no caben
+        visible = unsummarized[-2 * settings.history_recent_turns:] if settings.history_recent_turns > 0 else []
+        while len(visible) > 2 and estimate_message_tokens(visible) > budget:
+            visible = visible[2:]
+
+        fold_end = first_index + len(unsummarized) - len(visible)
+        return visible, fold_end
 
-        chat = Chat(history)
+    def _with_summary(self, summary: Dict, entries: List[Dict]) -> List[Dict]:
+        if not summary.get("summary"):
+            return entries
+        return [
+            {"role": "user", "content": f"Resumen de la conversación anterior:\n{summary['summary']}"},
+            {"role": "model", "content": "Entendido, continúo a partir de ese contexto."},
+            *entries,
+        ]
+
+    def _start_prefetch(self, context: Dict[str, Any], first_turn: bool):
+        """Lanzar las lecturas anticipadas (opt-in) y dejarlas en `context["prefetch"]` para las herramientas"""
+        settings = get_settings()
+        if settings.prefetch_mode == "always" or (settings.prefetch_mode == "first_turn" and first_turn):
+            base_context = dict(context)
+            context["prefetch"] = Prefetch({
+                name: (lambda name=name: TOOLS[name]["function"](base_context))
+                for name in settings.prefetch_tools
+                if name in TOOLS and TOOLS[name]["read_only"]
+            })
+
+    async def _get_chat_from_history(self, session_id: int, context: Optional[Dict[str, Any]] = None):
+        """
+        Crear objeto chat desde el historial guardado (resumen + turnos recientes dentro del presupuesto).
+        Con `context`, las lecturas anticipadas arrancan antes de crear el chat.
+        """
+        settings = get_settings()
+        with stage("history_load"):
+            window = await redis_service.get_chat_history_window(session_id, settings.history_max_loaded_turns)
+        if window is None:
+            await self.create_session(session_id)
+            window = ([], 0, {"summary": "", "covered": 0})
+
+        entries, start, summary = window
+        history, fold_end = self._apply_token_budget(entries, start, summary)
+
+        if fold_end is not None and settings.history_summary_enabled:
+            summary_service.schedule_fold(session_id, summary, fold_end)
+
+        if context is not None:
+            self._start_prefetch(context, first_turn=not entries and not summary.get("summary"))
+
+        chat = await Chat.create(self._with_summary(summary, history))
 
         return chat, history
 
-    def _save_history(self, session_id: int, history: List):
-        """Guardar historial actualizado"""
-        redis_service.set_chat_history(session_id, history)
+    async def _save_history(self, session_id: int, entries: List):
+        """Agregar los mensajes nuevos del turno al historial"""
+        with stage("history_save"):
+            await redis_service.append_chat_history(session_id, entries)
+
+    def _sse(self, event: Dict) -> bytes:
+        """Serializar un evento SSE incluyendo el id de traza de la petición"""
+        return sse_event({**event, 'trace_id': get_trace_id()})
+
+    async def _lookup_response_cache(self, session_id: int, message: str, jwt: str, use_cache: bool) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Devuelve (llave, respuesta cacheada); (None, None) si la memoización no aplica.
+        Solo aplica al primer mensaje de la sesión: la llave no incluye el historial, y una
+        respuesta de seguimiento ("Sí.", "¿Y el grupo B?") depende de él.
+        """
+        if not use_cache or not get_settings().response_cache_enabled or not normalize_message(message):
+            return None, None
+        try:
+            if await redis_service.has_history(session_id):
+                return None, None
+            key = await response_cache.build_key(message, jwt)
+            return key, await response_cache.get(key)
+        except Exception as e:
+            logger.warning("Caché de respuestas no disponible: %s", e)
+            return None, None
+
+    async def _store_response_cache(self, key: Optional[str], chat: Chat, response_text: str):
+        if key and response_text and is_memoizable(chat.called_tools, chat.tool_errors):
+            await response_cache.set(key, response_text)
+
+    async def _start_turn(self, endpoint: str, session_id: int, message: str, jwt: str,
+                          run: Callable[[], AsyncGenerator[Any, None]], queued_event: Any = None) -> TurnBroadcast:
+        """
+        Unirse al turno idéntico que ya está en curso o arrancar uno nuevo en segundo plano.
+        El turno corre con el lease de la sesión y termina (y se guarda) aunque el cliente se desconecte.
+        Con la política "reject" lanza SessionBusyError si la sesión está ocupada, y
+        AdmissionError si se supera el límite de tasa o la capacidad del proceso.
+        """
+        settings = get_settings()
+        key = (endpoint, session_id, get_user_id(jwt), normalize_message(message))
+        # Un mensaje que queda vacío al normalizarlo (solo signos) no se puede comparar con otros
+        coalesce = settings.request_coalescing and bool(key[-1])
+        if coalesce and key in self._inflight:
+            COALESCED_TURNS.labels(endpoint=endpoint).inc()
+            broadcast = self._inflight[key]
+            admitted = self._admitting.get(key)
+            if admitted is not None:
+                # El turno todavía espera admisión: si lo rechazan, esta petición recibe el mismo error
+                try:
+                    await asyncio.shield(admitted)
+                except asyncio.CancelledError:
+                    # Si la petición original se canceló, esta intenta arrancar el turno por su cuenta
+                    if not admitted.cancelled():
+                        raise
+                    return await self._start_turn(endpoint, session_id, message, jwt, run, queued_event)
+            return broadcast
+
+        # Registrar el turno antes de esperar la admisión, para que los duplicados se unan a él
+        broadcast = TurnBroadcast()
+        admitted = None
+        if coalesce:
+            self._inflight[key] = broadcast
+            admitted = asyncio.get_running_loop().create_future()
+            self._admitting[key] = admitted
+
+        slot = None
+        lease = SessionLease(session_id) if settings.session_lock_enabled else None
+        try:
+            # Con "reject" el lease se toma antes de la admisión: un 409 no gasta cupo ni tokens del usuario
+            if lease is not None and settings.session_lock_policy == "reject":
+                if not await lease.try_acquire():
+                    SESSION_LOCK_EVENTS.labels(outcome="rejected").inc()
+                    raise SessionBusyError(f"La sesión {session_id} ya está procesando otro mensaje")
+                SESSION_LOCK_EVENTS.labels(outcome="acquired").inc()
+
+            # Las peticiones que se unen a un turno en curso no cuentan para la admisión
+            slot = await admission_controller.admit(jwt)
+        except BaseException as e:
+            if slot is not None:
+                slot.release()
+            if lease is not None and lease.acquired:
+                await lease.release()
+            if self._inflight.get(key) is broadcast:
+                del self._inflight[key]
+            if admitted is not None:
+                if isinstance(e, asyncio.CancelledError):
+                    admitted.cancel()
+                else:
+                    admitted.set_exception(e)
+                    # Evitar "exception was never retrieved" cuando nadie más esperaba
+                    admitted.exception()
+            raise
+        finally:
+            if admitted is not None and self._admitting.get(key) is admitted:
+                del self._admitting[key]
+
+        if admitted is not None:
+            admitted.set_result(None)
+
+        def on_wait():
+            if queued_event is not None:
+                broadcast.publish(queued_event)
+
+        async def run_turn():
+            try:
+                if lease is not None and not lease.acquired:
+                    await lease.acquire(on_wait=on_wait)
+                async for event in run():
+                    broadcast.publish(event)
+                broadcast.close()
+            except Exception as e:
+                broadcast.close(e)
+            finally:
+                if self._inflight.get(key) is broadcast:
+                    del self._inflight[key]
+                if lease is not None:
+                    await lease.release()
+                if slot is not None:
+                    slot.release()
+
+        task = asyncio.create_task(run_turn())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return broadcast
+
+    async def send_message(self, session_id: int, message: str, jwt: str, use_cache: bool = True) -> str:
+        with timed(TURN_SECONDS, endpoint="message"):
+            async def run():
+                yield await self._send_message(session_id, message, jwt, use_cache)
 
-    def send_message(self, session_id: int, message: str) -> str:
-        chat, history = self._get_chat_from_history(session_id)
+            broadcast = await self._start_turn("message", session_id, message, jwt, run)
+            return await broadcast.result()
+
+    async def _send_message(self, session_id: int, message: str, jwt: str, use_cache: bool) -> str:
+        user_content = self._serialize_message_content(message)
+
+        cache_key, cached = await self._lookup_response_cache(session_id, message, jwt, use_cache)
+        if cached is not None:
+            if not await redis_service.session_exists(session_id):
+                await self.create_session(session_id)
+            await self._save_history(session_id, [
+                {"role": "user", "content": user_content},
+                {"role": "model", "content": cached},
+            ])
+            return cached
+
+        context = {
+            "jwt": jwt,
+            "schedule_id": session_id
+        }
+        chat, history = await self._get_chat_from_history(session_id, context)
 
         # Enviar mensaje
-        response_text = chat.send_message(message)
+        try:
+            response_text = await chat.send_message(message, context)
+        finally:
+            if "prefetch" in context:
+                context["prefetch"].finish()
 
         # Serialize content properly before storing
-        user_content = self._serialize_message_content(message)
         model_content = self._serialize_message_content(response_text)
 
-        # Actualizar historial
-        history.append({"role": "user", "content": user_content})
-        history.append({"role": "model", "content": model_content})
-
-        # Guardar historial actualizado
-        self._save_history(session_id, history)
+        # Guardar solo los mensajes nuevos del turno
+        await self._save_history(session_id, [
+            {"role": "user", "content": user_content},
+            {"role": "model", "content": model_content},
+        ])
+        await self._store_response_cache(cache_key, chat, model_content)
 
         return response_text
     
-    def send_message_stream(self, session_id: int, message: str, jwt: str) -> Generator[str, None, None]:
+    async def open_message_stream(self, session_id: int, message: str, jwt: str, use_cache: bool = True) -> AsyncGenerator[bytes, None]:
+        """
+        Arrancar el turno (o unirse al idéntico en curso) y devolver sus eventos SSE.
+        Se separa del consumo para que SessionBusyError se pueda responder como 409 antes de abrir el stream.
+        """
+        start = time.perf_counter()
+        turn_id = uuid.uuid4().hex[:16]
+
+        def run():
+            events = self._send_message_stream(session_id, message, jwt, use_cache, start)
+            if get_settings().turn_event_log_enabled:
+                return self._logged_turn(turn_id, session_id, jwt, events)
+            return events
+
+        broadcast = await self._start_turn(
+            "stream", session_id, message, jwt, run,
+            queued_event=self._sse({'type': 'status', 'message': 'Esperando a que termine el mensaje anterior...'}),
+        )
+
+        async def follow():
+            try:
+                async for event in broadcast.subscribe():
+                    yield event
+            finally:
+                TURN_SECONDS.labels(endpoint="stream").observe(time.perf_counter() - start)
+
+        return follow()
+
+    async def _logged_turn(self, turn_id: str, session_id: int, jwt: str, events: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+        """
+        Numerar los eventos del turno ("{turn_id}:{seq}") y guardarlos en el stream de Redis.
+        Cada evento se entrega antes de guardarlo: un escritor en segundo plano junta en un solo
+        round trip lo que se acumuló mientras escribía, y el registro se cierra al terminar el turno.
+        Si Redis falla el turno sigue, solo que ya no se podrá reanudar.
+        """
+        settings = get_settings()
+        pending: asyncio.Queue = asyncio.Queue()
+
+        async def write_log():
+            try:
+                await redis_service.create_turn_log(turn_id, session_id, get_user_id(jwt), settings.turn_event_ttl)
+                done = False
+                while not done:
+                    batch = [await pending.get()]
+                    while not pending.empty():
+                        batch.append(pending.get_nowait())
+                    done = batch[-1][1] is None
+                    await redis_service.append_turn_events(turn_id, batch, settings.turn_event_ttl, settings.turn_event_max_len)
+            except Exception as e:
+                logger.warning("No se pudo registrar el turno %s: %s", turn_id, e)
+
+        writer = asyncio.create_task(write_log())
+        seq = 0
+        try:
+            async for event in events:
+                seq += 1
+                event = with_event_id(event, f"{turn_id}:{seq}")
+                if not writer.done():
+                    pending.put_nowait((seq, event))
+                yield event
+        finally:
+            # Marca de fin y espera a que se escriba lo pendiente (el turno termina con el registro completo)
+            pending.put_nowait((seq + 1, None))
+            await asyncio.shield(writer)
+
+    async def resume_message_stream(self, turn_id: str, last_seq: int, jwt: str) -> AsyncGenerator[bytes, None]:
+        """
+        Reanudar un turno en streaming después del evento `last_seq`: reenvía los eventos perdidos
+        y sigue los nuevos sin volver a ejecutar el turno. KeyError si no existe, expiró o es de otro usuario.
+        """
+        owner = await redis_service.get_turn_owner(turn_id)
+        if owner is None or owner[0] != get_user_id(jwt):
+            raise KeyError(turn_id)
+        TURN_RESUMES.inc()
+
+        async def follow():
+            after = last_seq
+            idle_since = time.monotonic()
+            while True:
+                events = await redis_service.read_turn_events(turn_id, after, RESUME_BLOCK_MS)
+                if not events:
+                    # El worker que ejecutaba el turno pudo haber muerto sin cerrar el registro
+                    if time.monotonic() - idle_since > get_settings().turn_resume_idle_timeout:
+                        yield self._sse({'type': 'error', 'message': 'El turno dejó de emitir eventos'})
+                        return
+                    continue
+                idle_since = time.monotonic()
+                for seq, event in events:
+                    if event is None:
+                        return
+                    after = seq
+                    yield event
+
+        return follow()
+
+    async def send_message_stream(self, session_id: int, message: str, jwt: str, use_cache: bool = True) -> AsyncGenerator[bytes, None]:
         """Envía mensaje con streaming de eventos"""
-        chat, history = self._get_chat_from_history(session_id)
-        
-        yield f"data: {json.dumps({'type': 'status', 'message': 'Procesando mensaje...'})}\n\n"
+        async for event in await self.open_message_stream(session_id, message, jwt, use_cache):
+            yield event
+
+    async def _send_message_stream(self, session_id: int, message: str, jwt: str, use_cache: bool, start: float) -> AsyncGenerator[bytes, None]:
+        user_content = self._serialize_message_content(message)
+
+        cache_key, cached = await self._lookup_response_cache(session_id, message, jwt, use_cache)
+        if cached is not None:
+            yield self._sse({'type': 'status', 'message': 'Procesando mensaje...'})
+            yield self._sse({'type': 'delta', 'content': cached})
+            yield self._sse({'type': 'response', 'content': cached, 'message': 'Respuesta generada', 'cached': True})
+            await self._save_history(session_id, [
+                {"role": "user", "content": user_content},
+                {"role": "model", "content": cached},
+            ])
+            yield self._sse({'type': 'complete', 'message': 'Conversación guardada'})
+            return
 
         context = {
             "jwt": jwt,
             "schedule_id": session_id
         }
+        chat, history = await self._get_chat_from_history(session_id, context)
+        
+        yield self._sse({'type': 'status', 'message': 'Procesando mensaje...'})
 
         try:
             # Enviar mensaje y obtener respuesta con streaming
-            for event in chat.send_message_stream(message, context):
-                yield f"data: {json.dumps(event)}\n\n"
+            first_token = True
+            async for event in chat.send_message_stream(message, context):
+                if first_token and event["type"] == "delta":
+                    first_token = False
+                    FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                yield self._sse(event)
             
             # Actualizar historial al final
-            user_content = self._serialize_message_content(message)
             model_content = chat.get_last_response()
             
-            history.append({"role": "user", "content": user_content})
-            history.append({"role": "model", "content": model_content})
-            
-            self._save_history(session_id, history)
+            await self._save_history(session_id, [
+                {"role": "user", "content": user_content},
+                {"role": "model", "content": model_content},
+            ])
+            await self._store_response_cache(cache_key, chat, model_content)
             
-            yield f"data: {json.dumps({'type': 'complete', 'message': 'Conversación guardada'})}\n\n"
+            yield self._sse({'type': 'complete', 'message': 'Conversación guardada'})
             
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield self._sse({'type': 'error', 'message': str(e)})
+        finally:
+            if "prefetch" in context:
+                context["prefetch"].finish()
 
-    def delete_session(self, session_id: int):
+    async def delete_session(self, session_id: int):
         """Eliminar una sesión"""
-        redis_service.delete_session(session_id)
+        await redis_service.delete_session(session_id)
 
 
 chat_service = ChatService()
\ No newline at end of file
@@ -0,0 +1,110 @@
+import json
+import logging
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, Optional, Union
+
+from app.config import get_settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependencia opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Formato de los valores guardados en Redis:
+# - JSON plano (formato anterior y valores bajo el umbral de compresión)
+# - MAGIC + versión + algoritmo + payload comprimido
+# Un JSON nunca empieza con el byte 0, así que ambos formatos conviven en las mismas llaves.
+MAGIC = b"\x00"
+FORMAT_VERSION = 1
+ZLIB = b"z"
+ZSTD = b"s"
+
+
+def dumps(value: Any) -> bytes:
+    """JSON compacto en UTF-8 (orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def sse_event(event: Dict[str, Any]) -> bytes:
+    """Evento Server-Sent Events listo para enviar"""
+    return b"data: " + dumps(event) + b"\n\n"
+
+
+def with_event_id(payload: bytes, event_id: str) -> bytes:
+    """Agregar el campo `id:` a un evento SSE ya serializado (el cliente lo reenvía en Last-Event-ID)"""
+    return b"id: " + event_id.encode("utf-8") + b"\n" + payload
+
+
+class Codec:
+    """Serialización de valores guardados en Redis, con compresión por encima de un umbral"""
+
+    def __init__(self, compression: str = "none", threshold: int = 256, level: int = 3):
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard no está instalado; se usa zlib para comprimir")
+            compression = "zlib"
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+        if compression == "zstd":
+            self._zstd_compressor = zstandard.ZstdCompressor(level=level)
+
+    def encode(self, value: Any) -> bytes:
+        data = dumps(value)
+        if self.compression == "none" or len(data) < self.threshold:
+            return data
+        if self.compression == "zstd":
+            compressed, algorithm = self._zstd_compressor.compress(data), ZSTD
+        else:
+            compressed, algorithm = zlib.compress(data, self.level), ZLIB
+        if len(compressed) + 3 >= len(data):
+            return data
+        return MAGIC + bytes([FORMAT_VERSION]) + algorithm + compressed
+
+    def decode(self, raw: Union[bytes, str]) -> Any:
+        if isinstance(raw, str) or not raw.startswith(MAGIC):
+            return loads(raw)
+
+        version, algorithm, payload = raw[1], raw[2:3], raw[3:]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Versión de formato desconocida: {version}")
+        if algorithm == ZLIB:
+            return loads(zlib.decompress(payload))
+        if algorithm == ZSTD:
+            if zstandard is None:
+                raise ValueError("Valor comprimido con zstd pero zstandard no está instalado")
+            # Los valores se comprimen en un solo frame, que incluye el tamaño original
+            return loads(zstandard.ZstdDecompressor().decompress(payload))
+        raise ValueError(f"Algoritmo de compresión desconocido: {algorithm!r}")
+
+
+@lru_cache()
+def get_codec() -> Codec:
+    settings = get_settings()
+    return Codec(
+        compression=settings.storage_compression,
+        threshold=settings.storage_compression_threshold,
+        level=settings.storage_compression_level,
+    )
+
+
+def decode_text(raw: Optional[Union[bytes, str]]) -> Optional[str]:
+    """Valores simples (tokens, miembros de sets) leídos con el cliente en modo bytes"""
+    if isinstance(raw, bytes):
+        return raw.decode("utf-8")
+    return raw
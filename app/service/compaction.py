@@ -0,0 +1,158 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+
+from .metrics import TOOL_RESULT_BYTES
+from .tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Campos que el modelo nunca necesita para aconsejar horarios
+COMMON_DROP_KEYS = {
+    "createdAt", "updatedAt", "created_at", "updated_at", "deletedAt", "deleted_at",
+    "_links", "links", "href", "version", "__v", "password", "token",
+}
+
+# Proyección por herramienta: campos adicionales a descartar
+TOOL_DROP_KEYS: Dict[str, Set[str]] = {
+    "get_pensum": {"description", "descripcion", "image", "imageUrl"},
+    "get_schedule": {"user", "owner", "userId"},
+}
+
+# Objetos repetidos más pequeños que esto no vale la pena convertirlos en referencia
+MIN_REF_SIZE = 48
+
+_encode_str = json.encoder.encode_basestring
+_encode_scalar = json.JSONEncoder(ensure_ascii=False).encode
+
+COMPACT_NOTE = (
+    "Formato compacto: las listas de objetos vienen como {cols, rows} (una fila por objeto, "
+    "en el orden de cols); los valores '@N' son referencias a objetos repetidos definidos en refs."
+)
+
+
+def _prune(value: Any, drop: Set[str]) -> Any:
+    """
+    Quitar los campos descartados. Las listas vacías y los null se conservan:
+    "requisites": [] (sin requisitos) no es lo mismo que no saberlo.
+    """
+    if isinstance(value, dict):
+        return {key: _prune(item, drop) for key, item in value.items() if key not in drop}
+    if isinstance(value, list):
+        return [_prune(item, drop) for item in value]
+    return value
+
+
+def _dedupe(value: Any) -> Dict[str, Any]:
+    """Reemplazar objetos repetidos (profesores, franjas, etc.) por referencias '@N'"""
+    counts: Dict[str, int] = {}
+    # Serialización canónica de cada objeto por identidad; cada subárbol se serializa una sola vez
+    serials: Dict[int, str] = {}
+
+    def serialize(node: Any) -> str:
+        if isinstance(node, dict):
+            serialized = "{" + ", ".join(
+                f"{_encode_str(key)}: {serialize(node[key])}" for key in sorted(node)
+            ) + "}"
+            serials[id(node)] = serialized
+            if len(serialized) >= MIN_REF_SIZE:
+                counts[serialized] = counts.get(serialized, 0) + 1
+            return serialized
+        if isinstance(node, list):
+            return "[" + ", ".join(serialize(item) for item in node) + "]"
+        if isinstance(node, str):
+            return _encode_str(node)
+        return _encode_scalar(node)
+
+    serialize(value)
+    repeated = {key for key, n in counts.items() if n > 1}
+    refs: Dict[str, Any] = {}
+    ids: Dict[str, str] = {}
+
+    def replace(node: Any) -> Any:
+        if isinstance(node, dict):
+            if repeated:
+                serialized = serials[id(node)]
+                if serialized in repeated:
+                    if serialized not in ids:
+                        ids[serialized] = f"@{len(ids)}"
+                        refs[ids[serialized]] = {k: replace(v) for k, v in node.items()}
+                    return ids[serialized]
+            return {k: replace(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [replace(item) for item in node]
+        return node
+
+    return {"data": replace(value), "refs": refs}
+
+
+def _tabulate(value: Any) -> Any:
+    """
+    Convertir listas de objetos en tablas {cols, rows} para no repetir los nombres de campo.
+    Solo si todos tienen los mismos campos: en una fila un campo ausente se vería como null.
+    """
+    if isinstance(value, dict):
+        return {key: _tabulate(item) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [_tabulate(item) for item in value]
+        if len(items) >= 2 and all(isinstance(item, dict) for item in items):
+            cols: List[str] = list(items[0])
+            if all(len(item) == len(cols) and all(col in item for col in cols) for item in items):
+                return {"cols": cols, "rows": [[item[col] for col in cols] for item in items]}
+        return items
+    return value
+
+
+# Resultados compactados recientes por identidad del resultado cacheado (el caché local devuelve el mismo objeto)
+_compacted: "OrderedDict[Tuple[str, int], Tuple[Any, Any]]" = OrderedDict()
+MAX_COMPACTED = 64
+
+
+def compact_tool_result(tool_name: str, result: Any) -> Any:
+    """
+    Proyectar y compactar el resultado de una herramienta antes de enviarlo al modelo.
+    Los textos (por ejemplo, errores del backend) se devuelven sin cambios.
+    """
+    if not isinstance(result, (dict, list)):
+        return result
+
+    key = (tool_name, id(result))
+    entry = _compacted.get(key)
+    if entry is not None and entry[0] is result:
+        _compacted.move_to_end(key)
+        _, compacted, raw_bytes, sent_bytes = entry
+    else:
+        compacted, raw_bytes, sent_bytes = _compact(tool_name, result)
+        _compacted[key] = (result, compacted, raw_bytes, sent_bytes)
+        while len(_compacted) > MAX_COMPACTED:
+            _compacted.popitem(last=False)
+
+    TOOL_RESULT_BYTES.labels(tool=tool_name, stage="raw").inc(raw_bytes)
+    TOOL_RESULT_BYTES.labels(tool=tool_name, stage="sent").inc(sent_bytes)
+    return compacted
+
+
+def _compact(tool_name: str, result: Any) -> Tuple[Any, int, int]:
+    """(resultado para el modelo, bytes originales, bytes enviados)"""
+    raw = json.dumps(result, ensure_ascii=False)
+    raw_bytes = len(raw.encode("utf-8"))
+
+    pruned = _prune(result, COMMON_DROP_KEYS | TOOL_DROP_KEYS.get(tool_name, set()))
+    deduped = _dedupe(pruned)
+    compacted: Dict[str, Any] = {"note": COMPACT_NOTE, "data": _tabulate(deduped["data"])}
+    if deduped["refs"]:
+        compacted["refs"] = _tabulate(deduped["refs"])
+
+    compact = json.dumps(compacted, ensure_ascii=False, separators=(",", ":"))
+    if len(compact) >= len(raw):
+        # No hubo ganancia (payload pequeño): enviar el original
+        return result, raw_bytes, raw_bytes
+
+    compact_bytes = len(compact.encode("utf-8"))
+    logger.info(
+        "Compactación %s: %d -> %d bytes, ~%d -> ~%d tokens",
+        tool_name, raw_bytes, compact_bytes, estimate_tokens(raw), estimate_tokens(compact),
+        extra={"tool": tool_name},
+    )
+    return compacted, raw_bytes, compact_bytes
@@ -0,0 +1,139 @@
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+from .metrics import get_trace_id
+
+# Atributos estándar de un LogRecord; el resto viene de `extra=` y se agrega al JSON
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+
+class Truncated:
+    """
+    Valor que se convierte a texto (repr) y se recorta recién cuando el hilo escritor
+    formatea el registro, nunca en el camino caliente.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        return truncate(text, self.limit)
+
+
+def truncate(text: str, limit: Optional[int] = None) -> str:
+    limit = limit or get_settings().log_max_field_chars
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} caracteres omitidos]"
+
+
+def sampled() -> bool:
+    """Decidir si se registra un payload grande (resultados de herramientas, candidates)"""
+    rate = get_settings().log_payload_sample_rate
+    return rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con el id de traza y los campos de `extra=`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage()),
+        }
+        if getattr(record, "trace_id", ""):
+            entry["trace_id"] = record.trace_id
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(str(value))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = truncate(record.message)
+        return super().formatMessage(record)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Encola el registro sin formatearlo: el mensaje (y los repr costosos) se arman en el
+    hilo escritor. Si la cola está llena el registro se descarta en lugar de bloquear.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El id de traza vive en un contextvar: hay que leerlo en la tarea que registra
+        record.trace_id = get_trace_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingService:
+    def __init__(self):
+        self.handler: Optional[NonBlockingQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+
+    def setup(self):
+        """Configurar el logger `app` (idempotente) y arrancar el hilo escritor"""
+        if self.handler is not None:
+            return
+        settings = get_settings()
+
+        output = logging.StreamHandler()
+        output.setFormatter(JsonFormatter() if settings.log_json else TextFormatter())
+
+        self.handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+        self.listener = QueueListener(self.handler.queue, output, respect_handler_level=False)
+
+        logger = logging.getLogger("app")
+        logger.handlers = [self.handler]
+        logger.setLevel(settings.log_level.upper())
+        logger.propagate = False
+        for name, level in settings.log_levels.items():
+            logging.getLogger(name).setLevel(level.upper())
+
+        self.listener.start()
+
+    def shutdown(self):
+        """Vaciar la cola y detener el hilo escritor"""
+        if self.listener is not None:
+            self.listener.stop()
+        logging.getLogger("app").handlers = []
+        self.handler = None
+        self.listener = None
+
+    def get_stats(self) -> Dict[str, int]:
+        if self.handler is None:
+            return {"queue_depth": 0, "dropped": 0}
+        return {"queue_depth": self.handler.queue.qsize(), "dropped": self.handler.dropped}
+
+
+logging_service = LoggingService()
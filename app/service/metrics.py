@@ -0,0 +1,224 @@
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.datastructures import MutableHeaders
+
+# Id de traza de la petición en curso (se propaga a las tareas hijas vía contextvars)
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds",
+    "Duración de cada etapa de un turno (history_load, chat_build, model_round, history_save, ...)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+TOOL_CALL_SECONDS = Histogram(
+    "chat_tool_call_seconds",
+    "Duración de cada function call por herramienta y resultado",
+    ["tool", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+TURN_SECONDS = Histogram(
+    "chat_turn_seconds",
+    "Duración total de un turno por endpoint",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+FIRST_BYTE_SECONDS = Histogram(
+    "chat_stream_first_byte_seconds",
+    "Tiempo hasta el primer byte SSE enviado al cliente",
+    buckets=LATENCY_BUCKETS,
+)
+FIRST_TOKEN_SECONDS = Histogram(
+    "chat_stream_first_token_seconds",
+    "Tiempo hasta el primer evento delta con texto del modelo",
+    buckets=LATENCY_BUCKETS,
+)
+MODEL_TOKENS = Counter(
+    "gemini_tokens_total",
+    "Tokens reportados por Gemini en usage_metadata",
+    ["kind"],
+)
+SESSION_LOCK_EVENTS = Counter(
+    "chat_session_lock_events_total",
+    "Resultados del lease por sesión (acquired, waited, rejected, timeout, lost)",
+    ["outcome"],
+)
+SESSION_LOCK_WAIT_SECONDS = Histogram(
+    "chat_session_lock_wait_seconds",
+    "Tiempo esperando el lease de la sesión",
+    buckets=LATENCY_BUCKETS,
+)
+COALESCED_TURNS = Counter(
+    "chat_coalesced_turns_total",
+    "Peticiones que se unieron a un turno idéntico en curso",
+    ["endpoint"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "chat_admission_rejections_total",
+    "Turnos rechazados por el control de admisión (user_rate, process_rate, queue_full, queue_timeout)",
+    ["reason"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "chat_admission_wait_seconds",
+    "Tiempo en la cola de admisión hasta obtener cupo",
+    buckets=LATENCY_BUCKETS,
+)
+PREFETCH_EVENTS = Counter(
+    "chat_prefetch_events_total",
+    "Lecturas anticipadas por herramienta (hit, wasted, failed, discarded)",
+    ["tool", "outcome"],
+)
+MODEL_ROUNDS = Counter(
+    "chat_model_rounds_total",
+    "Rondas enviadas al modelo (base para las tasas de hedging y fallback)",
+    ["model"],
+)
+
+MODEL_HEDGES = Counter(
+    "chat_model_hedges_total",
+    "Peticiones duplicadas al modelo: sent, won (respondió primero el duplicado), lost",
+    ["outcome"],
+)
+
+MODEL_FALLBACKS = Counter(
+    "chat_model_fallbacks_total",
+    "Rondas repetidas con el modelo de respaldo",
+    ["reason"],
+)
+
+MODEL_TIMEOUTS = Counter(
+    "chat_model_timeouts_total",
+    "Timeouts del modelo por ronda o por presupuesto del turno",
+    ["scope"],
+)
+
+WARMUP_SECONDS = Gauge(
+    "chat_warmup_seconds",
+    "Duración del warmup al iniciar el proceso",
+)
+
+TOOL_RESULT_BYTES = Counter(
+    "chat_tool_result_bytes_total",
+    "Bytes de los resultados de herramientas antes (raw) y después (sent) de la compactación",
+    ["tool", "stage"],
+)
+
+TURN_RESUMES = Counter(
+    "chat_turn_resumes_total",
+    "Streams reanudados con Last-Event-ID (sin volver a ejecutar el turno)",
+)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_trace_id() -> str:
+    return trace_id_var.get()
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[None]:
+    """Observar la duración del bloque en el histograma (con etiquetas opcionales)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        target = histogram.labels(**labels) if labels else histogram
+        target.observe(time.perf_counter() - start)
+
+
+def stage(name: str):
+    return timed(STAGE_SECONDS, stage=name)
+
+
+USAGE_FIELDS = (
+    ("prompt_token_count", "prompt"),
+    ("candidates_token_count", "candidates"),
+    ("cached_content_token_count", "cached"),
+    ("thoughts_token_count", "thoughts"),
+    ("tool_use_prompt_token_count", "tool_use_prompt"),
+)
+
+
+def record_usage(usage_metadata: Any):
+    """Sumar los tokens de una respuesta de Gemini"""
+    if usage_metadata is None:
+        return
+    for field, kind in USAGE_FIELDS:
+        value = getattr(usage_metadata, field, None)
+        if value:
+            MODEL_TOKENS.labels(kind=kind).inc(value)
+
+
+class StatsCollector:
+    """
+    Exporta los contadores internos que ya llevan los servicios (pool HTTP, cachés, etc.)
+    sin duplicar la contabilidad en el camino caliente.
+    """
+
+    def __init__(self):
+        self._sources: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+
+    def register(self, name: str, source: Callable[[], Dict[str, Any]]):
+        self._sources.append((name, source))
+
+    def collect(self):
+        for name, source in self._sources:
+            try:
+                stats = source()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                metric_name = f"chat_{name}_{key}"
+                if key in ("size", "in_flight", "queue_depth"):
+                    yield GaugeMetricFamily(metric_name, f"{name}: {key}", value=value)
+                else:
+                    yield CounterMetricFamily(metric_name, f"{name}: {key}", value=value)
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+class TraceMiddleware:
+    """
+    Middleware ASGI que asigna un id de traza por petición (o reutiliza X-Trace-Id)
+    y lo devuelve en la cabecera X-Trace-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = ""
+        for name, value in scope.get("headers", []):
+            if name == b"x-trace-id":
+                trace_id = value.decode("latin-1")[:64]
+                break
+        trace_id = trace_id or new_trace_id()
+        token = trace_id_var.set(trace_id)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Trace-Id", trace_id)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            trace_id_var.reset(token)
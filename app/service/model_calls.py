@@ -0,0 +1,137 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from app.config import get_settings
+from .metrics import MODEL_HEDGES, MODEL_TIMEOUTS
+
+T = TypeVar("T")
+
+# Muestras mínimas antes de estimar el percentil (sin ellas no se hace hedging)
+MIN_LATENCY_SAMPLES = 20
+
+# Status de Gemini que indican sobrecarga o indisponibilidad del modelo
+OVERLOAD_CODES = {429, 500, 503, 504}
+OVERLOAD_STATUSES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED"}
+
+
+class ModelTimeoutError(TimeoutError):
+    """La ronda del modelo superó su timeout (`scope="round"`) o se agotó el presupuesto del turno (`"turn"`)"""
+
+    def __init__(self, scope: str):
+        MODEL_TIMEOUTS.labels(scope=scope).inc()
+        self.scope = scope
+        if scope == "turn":
+            super().__init__("Se agotó el tiempo máximo para responder este mensaje")
+        else:
+            super().__init__("El modelo tardó demasiado en responder")
+
+
+class TurnDeadline:
+    """Presupuesto de tiempo de un turno, repartido entre sus rondas con el modelo"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def round_timeout(self, per_round: float) -> float:
+        """Timeout de la próxima ronda: el de la ronda, o lo que quede del turno si es menos"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise ModelTimeoutError("turn")
+        return min(per_round, remaining)
+
+    def timeout_error(self) -> ModelTimeoutError:
+        return ModelTimeoutError("turn" if self.remaining() <= 0 else "round")
+
+
+class LatencyTracker:
+    """Latencias recientes de cada (modelo, tipo de llamada), para fijar el retraso del hedging"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def observe(self, model: str, kind: str, seconds: float):
+        samples = self._samples.get((model, kind))
+        if samples is None:
+            samples = self._samples[(model, kind)] = deque(maxlen=self.size)
+        samples.append(seconds)
+
+    def quantile(self, model: str, kind: str, q: float) -> Optional[float]:
+        samples = self._samples.get((model, kind))
+        if not samples or len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+latency_tracker = LatencyTracker()
+
+
+def hedge_delay(model: str, kind: str) -> Optional[float]:
+    """Segundos a esperar antes de enviar la petición duplicada (None = sin hedging)"""
+    settings = get_settings()
+    if not settings.model_hedge_enabled:
+        return None
+    latency = latency_tracker.quantile(model, kind, settings.model_hedge_quantile)
+    if latency is None:
+        return None
+    return max(settings.model_hedge_min_delay, latency)
+
+
+def overload_reason(error: BaseException) -> Optional[str]:
+    """Motivo por el que conviene pasar al modelo de respaldo, o None si el error es de otro tipo"""
+    if isinstance(error, ModelTimeoutError):
+        return "timeout" if error.scope == "round" else None
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if getattr(error, "code", None) in OVERLOAD_CODES or getattr(error, "status", None) in OVERLOAD_STATUSES:
+        return "overloaded"
+    return None
+
+
+async def run_hedged(
+    primary: Callable[[], Awaitable[T]],
+    hedge: Callable[[], Awaitable[T]],
+    delay: Optional[float],
+    timeout: float,
+) -> Tuple[T, bool]:
+    """
+    Ejecutar `primary`; si no terminó en `delay` segundos se lanza `hedge` y gana la primera
+    respuesta exitosa. Devuelve (resultado, True si ganó el hedge). La otra se cancela.
+    """
+    if delay is None or delay >= timeout:
+        return await asyncio.wait_for(primary(), timeout), False
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    first = asyncio.ensure_future(primary())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result(), False
+
+    second = asyncio.ensure_future(hedge())
+    MODEL_HEDGES.labels(outcome="sent").inc()
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                raise asyncio.TimeoutError()
+            for task in done:
+                if task.exception() is None:
+                    MODEL_HEDGES.labels(outcome="won" if task is second else "lost").inc()
+                    return task.result(), task is second
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
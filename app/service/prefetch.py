@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .metrics import PREFETCH_EVENTS
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetch:
+    """
+    Lecturas del backend lanzadas al llegar el mensaje, en paralelo con la primera ronda
+    del modelo. Si el modelo pide la misma herramienta se le entrega la tarea en curso.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], Awaitable[Any]]]):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        for name, loader in loaders.items():
+            task = asyncio.create_task(loader())
+            # Evitar "exception was never retrieved" si nadie la usa
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._tasks[name] = task
+
+    async def take(self, name: str) -> Tuple[bool, Any]:
+        """(True, resultado) si había una lectura anticipada de `name`; se entrega una sola vez"""
+        task = self._tasks.pop(name, None)
+        if task is None:
+            return False, None
+        try:
+            result = await task
+        except Exception as e:
+            # Se repite la llamada normal; el error real (si persiste) lo verá el modelo
+            logger.info("Prefetch de %s falló: %s", name, e)
+            PREFETCH_EVENTS.labels(tool=name, outcome="failed").inc()
+            return False, None
+        PREFETCH_EVENTS.labels(tool=name, outcome="hit").inc()
+        return True, result
+
+    def discard(self):
+        """Una modificación del horario deja obsoletas las lecturas pendientes: se cancelan"""
+        for name, task in self._tasks.items():
+            task.cancel()
+            PREFETCH_EVENTS.labels(tool=name, outcome="discarded").inc()
+        self._tasks.clear()
+
+    def finish(self):
+        """Al terminar el turno: lo que el modelo no pidió cuenta como desperdicio"""
+        for name in self._tasks:
+            PREFETCH_EVENTS.labels(tool=name, outcome="wasted").inc()
+        # No se cancelan: si terminan, igual dejan el resultado en el caché de herramientas
+        self._tasks.clear()
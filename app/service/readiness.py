@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from app.config import get_settings
+from .backend_service import backend_service
+from .chat import gemini_runtime
+from .metrics import WARMUP_SECONDS
+from .redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessService:
+    """
+    Arranque y disponibilidad del proceso:
+    - warmup(): precarga del SDK de Gemini, pools de Redis y HTTP y (opcional) el pensum
+    - check(): estado de Redis y del backend para /ready, cacheado `ready_cache_ttl` segundos
+    /health solo indica que el proceso vive; /ready que puede atender tráfico.
+    """
+
+    def __init__(self):
+        self.warmed_up = False
+        self.warmup_seconds: Optional[float] = None
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _step(self, name: str, step: Awaitable[Any]):
+        try:
+            await step
+        except Exception as e:
+            # Un warmup incompleto no impide arrancar: /ready lo reporta hasta que la dependencia responda
+            logger.warning("Warmup de %s falló: %s", name, e)
+
+    async def warmup(self):
+        settings = get_settings()
+        start = time.perf_counter()
+        if settings.warmup_enabled:
+            await asyncio.gather(
+                self._step("model", asyncio.to_thread(gemini_runtime.warmup)),
+                self._step("redis", redis_service.ping()),
+                self._step("backend", backend_service.startup()),
+            )
+            if settings.warmup_jwt:
+                await self._step("pensum", backend_service.get_pensum(settings.warmup_jwt))
+        else:
+            await backend_service.startup()
+
+        self.warmup_seconds = time.perf_counter() - start
+        WARMUP_SECONDS.set(self.warmup_seconds)
+        self.warmed_up = True
+        logger.info("Warmup completo en %.2f s", self.warmup_seconds)
+
+    async def _check(self, step: Awaitable[Any], timeout: float) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            ok = bool(await asyncio.wait_for(step, timeout))
+            error = None if ok else "respuesta con error"
+        except asyncio.TimeoutError:
+            ok, error = False, "timeout"
+        except Exception as e:
+            ok, error = False, str(e)
+        result: Dict[str, Any] = {"ok": ok, "ms": round((time.perf_counter() - start) * 1000, 1)}
+        if error:
+            result["error"] = error
+        return result
+
+    async def check(self) -> Dict[str, Any]:
+        """Estado de las dependencias; varias sondas seguidas comparten el mismo chequeo"""
+        settings = get_settings()
+        if self._result is not None and time.monotonic() - self._checked_at < settings.ready_cache_ttl:
+            return self._result
+
+        async with self._lock:
+            if self._result is not None and time.monotonic() - self._checked_at < settings.ready_cache_ttl:
+                return self._result
+
+            timeout = settings.ready_check_timeout
+            redis_check, backend_check = await asyncio.gather(
+                self._check(redis_service.ping(), timeout),
+                self._check(backend_service.ping(timeout), timeout),
+            )
+            checks = {"redis": redis_check, "backend": backend_check}
+            self._result = {
+                "ready": self.warmed_up and all(check["ok"] for check in checks.values()),
+                "warmed_up": self.warmed_up,
+                "checks": checks,
+            }
+            self._checked_at = time.monotonic()
+            return self._result
+
+
+readiness_service = ReadinessService()
@@ -1,55 +1,324 @@
-import redis
-import json
-from typing import Optional, List, Dict
+import redis.asyncio as redis
+import time
+from typing import Optional, List, Dict, Tuple
 from app.config import get_settings
+from .codec import decode_text, get_codec
+
+# Sorted set de sesiones activas; el score es el timestamp de expiración
+SESSIONS_KEY = "chat:sessions:active"
+# Set del formato anterior (sin expiración por miembro)
+LEGACY_SESSIONS_KEY = "chat:sessions"
+
+# Token bucket atómico: recarga según el tiempo del servidor y consume un token si hay.
+# Devuelve {permitido, segundos hasta el próximo token}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
 
 class RedisService:
     def __init__(self):
         settings = get_settings()
-        self.client = redis.from_url(settings.redis_url, decode_responses=True)  # decode_responses=True
-    
-    def set_chat_history(self, session_id: int, history: List[Dict], expire_hours: int = 24):
-        """Guardar historial del chat como JSON"""
-        history_json = json.dumps(history)
-        self.client.set(f"chat:{session_id}", history_json, ex=expire_hours * 3600)
-    
-    def get_chat_history(self, session_id: int) -> Optional[List[Dict]]:
-        """Recuperar historial del chat"""
-        history_json = self.client.get(f"chat:{session_id}")
-        if not history_json:
+        # El pool no abre conexiones hasta el primer comando
+        self.pool = redis.ConnectionPool.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            health_check_interval=settings.redis_health_check_interval,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+            # Modo bytes: los valores grandes se guardan comprimidos (ver codec.py)
+            decode_responses=False,
+        )
+        self.client = redis.Redis(connection_pool=self.pool)
+        self._token_bucket = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def ping(self) -> bool:
+        """Abre (o reutiliza) una conexión del pool; lo usan el warmup y /ready"""
+        return await self.client.ping()
+
+    async def close(self):
+        """Cerrar el cliente y las conexiones del pool"""
+        await self.client.aclose()
+        await self.pool.aclose()
+
+    def _history_key(self, session_id: int) -> str:
+        # Lista de Redis con un elemento JSON por mensaje (append-only)
+        return f"chat:{session_id}:messages"
+
+    def _legacy_history_key(self, session_id: int) -> str:
+        # Formato anterior: todo el historial como un único string JSON
+        return f"chat:{session_id}"
+
+    def _summary_key(self, session_id: int) -> str:
+        # Resumen acumulado de los mensajes más antiguos: {"summary": str, "covered": int}
+        return f"chat:{session_id}:summary"
+
+    def _lock_key(self, session_id: int) -> str:
+        # Lease del turno en curso: el valor es el token del dueño
+        return f"chat:{session_id}:lock"
+
+    async def acquire_session_lock(self, session_id: int, token: str, ttl_ms: int) -> bool:
+        """Tomar el lease de la sesión si está libre (SET NX PX)"""
+        return bool(await self.client.set(self._lock_key(session_id), token, nx=True, px=ttl_ms))
+
+    async def _if_lock_owner(self, session_id: int, token: str, command: str, *args) -> bool:
+        """Ejecutar `command` sobre el lease solo si sigue siendo nuestro (WATCH)"""
+        key = self._lock_key(session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if decode_text(await pipe.get(key)) != token:
+                    return False
+                pipe.multi()
+                getattr(pipe, command)(key, *args)
+                await pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    async def refresh_session_lock(self, session_id: int, token: str, ttl_ms: int) -> bool:
+        """Extender el lease; False si expiró y lo tomó otro worker"""
+        return await self._if_lock_owner(session_id, token, "pexpire", ttl_ms)
+
+    async def release_session_lock(self, session_id: int, token: str) -> bool:
+        return await self._if_lock_owner(session_id, token, "delete")
+
+    def _turn_key(self, turn_id: str) -> str:
+        # Dueño del turno en streaming: {user, session}
+        return f"chat:turn:{turn_id}"
+
+    def _turn_events_key(self, turn_id: str) -> str:
+        # Stream con los eventos SSE del turno; el id de cada entrada es "{seq}-0"
+        return f"chat:turn:{turn_id}:events"
+
+    async def create_turn_log(self, turn_id: str, session_id: int, user_id: str, ttl: int):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._turn_key(turn_id), mapping={"user": user_id, "session": session_id})
+            pipe.expire(self._turn_key(turn_id), ttl)
+            await pipe.execute()
+
+    async def get_turn_owner(self, turn_id: str) -> Optional[Tuple[str, int]]:
+        """(usuario, sesión) del turno o None si no existe o ya expiró"""
+        owner = await self.client.hgetall(self._turn_key(turn_id))
+        if not owner:
             return None
-        return json.loads(history_json)
-    
-    def add_session(self, session_id: int, expire_hours: int = 24):
+        return decode_text(owner[b"user"]), int(owner[b"session"])
+
+    async def append_turn_events(self, turn_id: str, events: List[Tuple[int, Optional[bytes]]], ttl: int, max_len: int):
+        """
+        Agregar eventos [(seq, evento SSE o None para la marca de fin)] al stream del turno
+        y renovar su TTL en un round trip
+        """
+        key = self._turn_events_key(turn_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for seq, data in events:
+                pipe.xadd(key, {"end": "1"} if data is None else {"data": data}, id=f"{seq}-0", maxlen=max_len, approximate=True)
+            pipe.expire(key, ttl)
+            pipe.expire(self._turn_key(turn_id), ttl)
+            await pipe.execute()
+
+    async def read_turn_events(self, turn_id: str, after: int, block_ms: int, count: int = 100) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Eventos con seq > `after`, esperando hasta `block_ms` si todavía no hay.
+        Devuelve [(seq, evento SSE o None si es la marca de fin)].
+        """
+        response = await self.client.xread({self._turn_events_key(turn_id): f"{after}-0"}, count=count, block=block_ms)
+        events = []
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                seq = int(decode_text(entry_id).split("-")[0])
+                events.append((seq, None if b"end" in fields else fields[b"data"]))
+        return events
+
+    async def take_rate_token(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        """Consumir un token del bucket `key` (rate en tokens/segundo); devuelve (permitido, retry_after)"""
+        allowed, retry_after = await self._token_bucket(keys=[key], args=[rate, burst], client=self.client)
+        return bool(allowed), float(retry_after)
+
+    async def create_session(self, session_id: int, expire_hours: int = 24):
+        """Crear una sesión con historial vacío en una sola transacción (MULTI/EXEC)"""
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(
+                self._history_key(session_id),
+                self._legacy_history_key(session_id),
+                self._summary_key(session_id),
+            )
+            pipe.zadd(SESSIONS_KEY, {session_id: time.time() + expire_hours * 3600})
+            # Crear meta para TTL
+            pipe.set(f"session:meta:{session_id}", "active", ex=expire_hours * 3600)
+            await pipe.execute()
+
+    async def append_chat_history(self, session_id: int, entries: List[Dict], expire_hours: int = 24):
+        """Agregar mensajes al final del historial y renovar el TTL en un solo round trip"""
+        if not entries:
+            return
+        key = self._history_key(session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *[get_codec().encode(entry) for entry in entries])
+            pipe.expire(key, expire_hours * 3600)
+            pipe.expire(self._summary_key(session_id), expire_hours * 3600)
+            pipe.expire(f"session:meta:{session_id}", expire_hours * 3600)
+            pipe.zadd(SESSIONS_KEY, {session_id: time.time() + expire_hours * 3600}, xx=True)
+            await pipe.execute()
+
+    async def get_chat_history_window(self, session_id: int, max_turns: int) -> Optional[Tuple[List[Dict], int, Dict]]:
+        """
+        Recuperar los últimos `max_turns` turnos junto con el resumen acumulado.
+        Devuelve (mensajes, índice absoluto del primer mensaje, resumen) o None si la sesión no existe.
+        """
+        key = self._history_key(session_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrange(key, -2 * max_turns, -1)
+            pipe.llen(key)
+            pipe.get(self._summary_key(session_id))
+            pipe.exists(f"session:meta:{session_id}")
+            pipe.exists(self._legacy_history_key(session_id))
+            entries, length, summary_json, meta_exists, legacy_exists = await pipe.execute()
+
+        if legacy_exists:
+            await self._migrate_legacy_history(session_id)
+            return await self.get_chat_history_window(session_id, max_turns)
+
+        if not entries and not meta_exists:
+            return None
+
+        codec = get_codec()
+        summary = codec.decode(summary_json) if summary_json else {"summary": "", "covered": 0}
+        return [codec.decode(entry) for entry in entries], length - len(entries), summary
+
+    async def has_history(self, session_id: int) -> bool:
+        """True si la sesión ya tiene mensajes o resumen (en cualquiera de los dos formatos)"""
+        return await self.client.exists(
+            self._history_key(session_id),
+            self._legacy_history_key(session_id),
+            self._summary_key(session_id),
+        ) > 0
+
+    async def get_history_range(self, session_id: int, start: int, end: int) -> List[Dict]:
+        """Mensajes con índice absoluto en [start, end)"""
+        if end <= start:
+            return []
+        entries = await self.client.lrange(self._history_key(session_id), start, end - 1)
+        return [get_codec().decode(entry) for entry in entries]
+
+    async def set_history_summary(self, session_id: int, summary: str, covered: int, expected_covered: int, expire_hours: int = 24) -> bool:
+        """
+        Guardar el resumen solo si nadie lo actualizó desde que se leyó (WATCH).
+        Devuelve False si otro worker ya lo había avanzado.
+        """
+        key = self._summary_key(session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                current = await pipe.get(key)
+                current_covered = get_codec().decode(current)["covered"] if current else 0
+                if current_covered != expected_covered:
+                    return False
+                pipe.multi()
+                pipe.set(key, get_codec().encode({"summary": summary, "covered": covered}), ex=expire_hours * 3600)
+                await pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    async def _migrate_legacy_history(self, session_id: int):
+        """
+        Convertir el string JSON `chat:{id}` del formato anterior en la lista append-only.
+        Vigila la llave anterior (WATCH): si otro worker ya la migró no se toca la lista.
+        """
+        legacy_key = self._legacy_history_key(session_id)
+        key = self._history_key(session_id)
+        codec = get_codec()
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(legacy_key)
+                history_json = await pipe.get(legacy_key)
+                if history_json is None:
+                    return
+                ttl = await pipe.ttl(legacy_key)
+                history = codec.decode(history_json) if history_json else []
+                pipe.multi()
+                pipe.delete(key, legacy_key)
+                if history:
+                    pipe.rpush(key, *[codec.encode(entry) for entry in history])
+                    if ttl and ttl > 0:
+                        pipe.expire(key, ttl)
+                await pipe.execute()
+            except redis.WatchError:
+                return
+
+    async def add_session(self, session_id: int, expire_hours: int = 24):
         """Agregar sesión a la lista"""
-        self.client.sadd("chat:sessions", session_id)
-        # Crear meta para TTL
-        self.client.set(f"session:meta:{session_id}", "active", ex=expire_hours * 3600)
-    
-    def get_sessions(self) -> list[str]:
-        """Obtener todas las sesiones activas"""
-        all_sessions = self.client.smembers("chat:sessions")
-        active_sessions = []
-        
-        for session in all_sessions:
-            # Verificar si la sesión sigue activa
-            if self.client.exists(f"session:meta:{session}"):
-                active_sessions.append(session)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(SESSIONS_KEY, {session_id: time.time() + expire_hours * 3600})
+            # Crear meta para TTL
+            pipe.set(f"session:meta:{session_id}", "active", ex=expire_hours * 3600)
+            await pipe.execute()
+
+    async def get_sessions(self, offset: int = 0, limit: Optional[int] = None) -> list[str]:
+        """Obtener las sesiones activas (paginadas), limpiando las expiradas en el mismo round trip"""
+        now = time.time()
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(SESSIONS_KEY, "-inf", now)
+            if limit is None:
+                pipe.zrangebyscore(SESSIONS_KEY, now, "+inf")
             else:
-                # Limpiar sesión expirada
-                self.client.srem("chat:sessions", session)
-        
-        return active_sessions
-    
-    def delete_session(self, session_id: int):
+                pipe.zrangebyscore(SESSIONS_KEY, now, "+inf", start=offset, num=limit)
+            _, sessions = await pipe.execute()
+        return [decode_text(session) for session in sessions]
+
+    async def migrate_legacy_sessions(self):
+        """Pasar las sesiones del set `chat:sessions` al sorted set con su expiración"""
+        legacy_sessions = await self.client.smembers(LEGACY_SESSIONS_KEY)
+        if not legacy_sessions:
+            return
+
+        legacy_sessions = [decode_text(session) for session in legacy_sessions]
+        async with self.client.pipeline(transaction=False) as pipe:
+            for session in legacy_sessions:
+                pipe.ttl(f"session:meta:{session}")
+            ttls = await pipe.execute()
+
+        now = time.time()
+        async with self.client.pipeline(transaction=True) as pipe:
+            for session, ttl in zip(legacy_sessions, ttls):
+                if ttl and ttl > 0:
+                    pipe.zadd(SESSIONS_KEY, {session: now + ttl})
+            pipe.delete(LEGACY_SESSIONS_KEY)
+            await pipe.execute()
+
+    async def delete_session(self, session_id: int):
         """Eliminar sesión"""
-        self.client.delete(f"chat:{session_id}")
-        self.client.delete(f"session:meta:{session_id}")
-        self.client.srem("chat:sessions", session_id)
-    
-    def session_exists(self, session_id: int) -> bool:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(
+                self._history_key(session_id),
+                self._legacy_history_key(session_id),
+                self._summary_key(session_id),
+                f"session:meta:{session_id}",
+            )
+            pipe.zrem(SESSIONS_KEY, session_id)
+            await pipe.execute()
+
+    async def session_exists(self, session_id: int) -> bool:
         """Verificar si existe una sesión"""
-        return (self.client.exists(f"chat:{session_id}") > 0 and 
-                self.client.exists(f"session:meta:{session_id}") > 0)
+        # El historial puede estar vacío (una lista vacía no existe en Redis): basta con la meta
+        return await self.client.exists(f"session:meta:{session_id}") > 0
 
-redis_service = RedisService()
\ No newline at end of file
+redis_service = RedisService()
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+from app.config import get_settings
+from .backend_service import backend_service
+from .cache_service import ToolCache
+from .chat import gemini_runtime
+
+# Herramientas cuyo resultado depende solo del pensum: una respuesta que solo usó
+# estas (o ninguna) puede reutilizarse mientras el pensum y el prompt no cambien
+MEMOIZABLE_TOOLS = {"get_pensum"}
+
+_pensum_versions: "OrderedDict[int, Tuple[Any, str]]" = OrderedDict()
+MAX_PENSUM_VERSIONS = 64
+
+
+def normalize_message(message: str) -> str:
+    """
+    Minúsculas, sin tildes, espacios colapsados y sin signos de puntuación en los extremos.
+    Solo se quitan las marcas diacríticas: emojis y otros alfabetos se conservan.
+    """
+    decomposed = unicodedata.normalize("NFKD", message)
+    normalized = "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+    normalized = re.sub(r"\s+", " ", normalized)
+    return normalized.strip(" ?¿!¡.,;:")
+
+
+def pensum_version(pensum: Any) -> str:
+    """Hash del contenido del pensum, memoizado por identidad del objeto cacheado"""
+    entry = _pensum_versions.get(id(pensum))
+    if entry is not None and entry[0] is pensum:
+        return entry[1]
+    version = hashlib.sha256(json.dumps(pensum, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    _pensum_versions[id(pensum)] = (pensum, version)
+    while len(_pensum_versions) > MAX_PENSUM_VERSIONS:
+        _pensum_versions.popitem(last=False)
+    return version
+
+
+def is_memoizable(called_tools: Iterable[str], tool_errors: int) -> bool:
+    return tool_errors == 0 and all(name in MEMOIZABLE_TOOLS for name in called_tools)
+
+
+class ResponseCache:
+    """
+    Caché exacto (sin semántica) de respuestas del modelo por mensaje normalizado,
+    versión del prompt y versión del pensum del usuario. La llave no incluye el historial,
+    así que solo se usa para el primer mensaje de una sesión.
+    """
+
+    def __init__(self):
+        settings = get_settings()
+        self.store = ToolCache(prefix="response", max_entries=settings.response_cache_max_entries)
+
+    async def build_key(self, message: str, jwt: str) -> str:
+        settings = get_settings()
+        gemini_runtime.get_prompt()
+        pensum = await backend_service.get_pensum(jwt)
+        raw_key = "\n".join([
+            settings.model_name,
+            gemini_runtime.prompt_hash,
+            pensum_version(pensum),
+            normalize_message(message),
+        ])
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        cached = await self.store.get(key, local_ttl=get_settings().response_cache_ttl)
+        return cached["text"] if cached else None
+
+    async def set(self, key: str, text: str):
+        await self.store.set(key, {"text": text}, get_settings().response_cache_ttl)
+
+    def get_stats(self):
+        return self.store.get_stats()
+
+
+response_cache = ResponseCache()
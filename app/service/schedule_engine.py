@@ -0,0 +1,292 @@
+import asyncio
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .backend_service import backend_service
+
+# Resolución de las franjas: cada bit del mapa semanal representa 30 minutos
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAY_NAMES = ["LUN", "MAR", "MIE", "JUE", "VIE", "SAB", "DOM"]
+
+DAY_ALIASES = {
+    "LUNES": 0, "LU": 0, "LUN": 0, "MONDAY": 0, "MON": 0, "MO": 0,
+    "MARTES": 1, "MA": 1, "MAR": 1, "TUESDAY": 1, "TUE": 1, "TU": 1,
+    "MIERCOLES": 2, "MI": 2, "MIE": 2, "WEDNESDAY": 2, "WED": 2, "WE": 2,
+    "JUEVES": 3, "JU": 3, "JUE": 3, "THURSDAY": 3, "THU": 3, "TH": 3,
+    "VIERNES": 4, "VI": 4, "VIE": 4, "FRIDAY": 4, "FRI": 4, "FR": 4,
+    "SABADO": 5, "SA": 5, "SAB": 5, "SATURDAY": 5, "SAT": 5,
+    "DOMINGO": 6, "DO": 6, "DOM": 6, "SUNDAY": 6, "SUN": 6, "SU": 6,
+}
+
+# Nombres de campo aceptados en el JSON del backend
+CODE_KEYS = ("code", "codigo")
+GROUPS_KEYS = ("groups", "grupos")
+SESSIONS_KEYS = ("sessions", "schedules", "schedule", "horarios", "horario", "sesiones", "classes")
+DAY_KEYS = ("day", "dia", "weekday", "dayOfWeek")
+BEGIN_KEYS = ("beginHour", "startHour", "begin", "start", "startTime", "horaInicio", "inicio")
+END_KEYS = ("endHour", "end", "endTime", "horaFin", "fin")
+NAME_KEYS = ("name", "nombre")
+REQUISITES_KEYS = ("requisites", "prerequisites", "requisitos", "prerrequisitos")
+APPROVED_KEYS = ("approved", "aprobada", "passed")
+APPROVED_STATUSES = {"APPROVED", "APROBADA", "PASSED", "CURSADA"}
+
+
+def _first(data: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    for key in keys:
+        if data.get(key) is not None:
+            return data[key]
+    return None
+
+
+def _parse_day(value: Any) -> Optional[int]:
+    if isinstance(value, int):
+        # Convención ISO (DayOfWeek): 1 = lunes ... 7 = domingo
+        return (value - 1) % 7
+    if isinstance(value, str):
+        normalized = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode().strip().upper()
+        if normalized.isdigit():
+            return (int(normalized) - 1) % 7
+        return DAY_ALIASES.get(normalized)
+    return None
+
+
+def _parse_minutes(value: Any) -> Optional[int]:
+    """Hora del día en minutos: 6, 6.5, "06:00" o "06:00:00" """
+    if isinstance(value, (int, float)):
+        return int(value * 60)
+    if isinstance(value, str) and value:
+        parts = value.split(":")
+        try:
+            return int(parts[0]) * 60 + (int(parts[1]) if len(parts) > 1 else 0)
+        except ValueError:
+            return None
+    return None
+
+
+def _session_mask(session: Dict[str, Any]) -> Optional[int]:
+    day = _parse_day(_first(session, DAY_KEYS))
+    begin = _parse_minutes(_first(session, BEGIN_KEYS))
+    end = _parse_minutes(_first(session, END_KEYS))
+    if day is None or begin is None or end is None or end <= begin:
+        return None
+    first_slot = begin // SLOT_MINUTES
+    last_slot = min(SLOTS_PER_DAY, -(-end // SLOT_MINUTES))
+    width = last_slot - first_slot
+    return ((1 << width) - 1) << (day * SLOTS_PER_DAY + first_slot)
+
+
+def describe_mask(mask: int) -> List[str]:
+    """Representación legible de un mapa semanal: ["LUN 06:00-08:00", ...]"""
+    ranges = []
+    for day in range(7):
+        day_bits = (mask >> (day * SLOTS_PER_DAY)) & ((1 << SLOTS_PER_DAY) - 1)
+        slot = 0
+        while day_bits:
+            if day_bits & 1:
+                start = slot
+                while day_bits & 1:
+                    day_bits >>= 1
+                    slot += 1
+                ranges.append(
+                    f"{DAY_NAMES[day]} {start * SLOT_MINUTES // 60:02d}:{start * SLOT_MINUTES % 60:02d}"
+                    f"-{slot * SLOT_MINUTES // 60:02d}:{slot * SLOT_MINUTES % 60:02d}"
+                )
+            else:
+                day_bits >>= 1
+                slot += 1
+    return ranges
+
+
+def _walk(node: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(node, dict):
+        yield node
+        for item in node.values():
+            yield from _walk(item)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item)
+
+
+def _sessions_of(group: Dict[str, Any]) -> List[Dict[str, Any]]:
+    sessions = _first(group, SESSIONS_KEYS)
+    if isinstance(sessions, list):
+        return [s for s in sessions if isinstance(s, dict)]
+    return []
+
+
+def _group_mask(group: Dict[str, Any]) -> Optional[int]:
+    """
+    Mapa semanal de un grupo, o None si no se pudo leer su horario (sin sesiones
+    reconocibles o con alguna franja en un formato desconocido)
+    """
+    mask = 0
+    for session in _sessions_of(group):
+        session_mask = _session_mask(session)
+        if session_mask is None:
+            return None
+        mask |= session_mask
+    return mask or None
+
+
+class ScheduleIndex:
+    """
+    Índice de los grupos del pensum con su horario como mapa de bits semanal
+    (un bit por franja de 30 minutos). Verificar un cruce es un AND entre enteros.
+    """
+
+    def __init__(self, pensum: Any):
+        self.groups: Dict[str, Dict[str, Any]] = {}
+        self.subjects: Dict[str, Dict[str, Any]] = {}
+
+        for node in _walk(pensum):
+            code = _first(node, CODE_KEYS)
+            groups = _first(node, GROUPS_KEYS)
+            if code is None or not isinstance(groups, list):
+                continue
+
+            subject_code = str(code)
+            requisites = []
+            for requisite in _first(node, REQUISITES_KEYS) or []:
+                requisite_code = _first(requisite, CODE_KEYS) if isinstance(requisite, dict) else requisite
+                if requisite_code is not None:
+                    requisites.append(str(requisite_code))
+
+            approved = _first(node, APPROVED_KEYS)
+            if approved is None and isinstance(node.get("status"), str):
+                approved = node["status"].upper() in APPROVED_STATUSES
+
+            subject = {
+                "code": subject_code,
+                "name": _first(node, NAME_KEYS),
+                "requisites": requisites,
+                "approved": approved,
+                "groups": [],
+            }
+            self.subjects[subject_code] = subject
+
+            for group in groups:
+                if not isinstance(group, dict) or _first(group, CODE_KEYS) is None:
+                    continue
+                group_code = str(_first(group, CODE_KEYS))
+                self.groups[group_code] = {"code": group_code, "subject": subject_code, "mask": _group_mask(group)}
+                subject["groups"].append(group_code)
+
+    def enrolled_groups(self, schedule: Any) -> Dict[str, Optional[int]]:
+        """Grupos inscritos en el horario con su mapa de bits (None si no se pudo leer)"""
+        enrolled: Dict[str, Optional[int]] = {}
+        for node in _walk(schedule):
+            code = _first(node, CODE_KEYS)
+            if code is None or str(code) not in self.groups:
+                continue
+            # Si el horario no trae las sesiones se usan las del pensum
+            enrolled[str(code)] = _group_mask(node) or self.groups[str(code)]["mask"]
+        return enrolled
+
+    def check_group(self, group_code: str, enrolled: Dict[str, Optional[int]]) -> Dict[str, Any]:
+        group = self.groups.get(group_code)
+        if group is None:
+            return {"group_code": group_code, "error": "Grupo no encontrado en el pensum"}
+        if group["mask"] is None:
+            # Sin franjas no se puede afirmar que encaja: mejor no responder que responder mal
+            return {
+                "group_code": group_code,
+                "subject_code": group["subject"],
+                "compatible": None,
+                "error": "No se pudo leer el horario del grupo; verifica con get_schedule",
+            }
+
+        # Los grupos de la misma materia no cuentan: se reemplazarían con change_group
+        others = {
+            code: mask for code, mask in enrolled.items()
+            if self.groups[code]["subject"] != group["subject"]
+        }
+        conflicts = [code for code, mask in others.items() if mask and mask & group["mask"]]
+        unknown = [code for code, mask in others.items() if mask is None]
+        result = {
+            "group_code": group_code,
+            "subject_code": group["subject"],
+            "slots": describe_mask(group["mask"]),
+            # Si no hay cruces conocidos pero hay grupos inscritos sin horario legible, no se sabe
+            "compatible": False if conflicts else (None if unknown else True),
+        }
+        if unknown and not conflicts:
+            result["unknown_slots"] = unknown
+        if conflicts:
+            result["conflicts"] = [
+                {"group_code": code, "overlap": describe_mask(enrolled[code] & group["mask"])}
+                for code in conflicts
+            ]
+        return result
+
+    def check_requisites(self, subject_code: str) -> Dict[str, Any]:
+        subject = self.subjects.get(subject_code)
+        if subject is None:
+            return {}
+        missing = [
+            code for code in subject["requisites"]
+            if self.subjects.get(code, {}).get("approved") is False
+        ]
+        unknown = [
+            code for code in subject["requisites"]
+            if self.subjects.get(code, {}).get("approved") is None
+        ]
+        result: Dict[str, Any] = {"requisites_met": not missing}
+        if missing:
+            result["missing_requisites"] = missing
+        if unknown:
+            result["requisites_unknown_status"] = unknown
+        return result
+
+
+# Índices recientes por identidad del pensum cacheado (el caché local devuelve el mismo objeto)
+_indexes: "OrderedDict[int, Tuple[Any, ScheduleIndex]]" = OrderedDict()
+MAX_INDEXES = 64
+
+
+def get_index(pensum: Any) -> ScheduleIndex:
+    entry = _indexes.get(id(pensum))
+    if entry is not None and entry[0] is pensum:
+        _indexes.move_to_end(id(pensum))
+        return entry[1]
+    index = ScheduleIndex(pensum)
+    _indexes[id(pensum)] = (pensum, index)
+    while len(_indexes) > MAX_INDEXES:
+        _indexes.popitem(last=False)
+    return index
+
+
+async def check_schedule_options(jwt: str, schedule_id: int, subject_code: str = None, group_code: str = None, **kwargs) -> Dict[str, Any]:
+    """
+    Responder localmente qué grupos encajan en el horario actual, usando los datos
+    cacheados de get_pensum/get_schedule (sin modificar nada en el backend).
+    """
+    if not subject_code and not group_code:
+        raise ValueError("Se requiere subject_code o group_code")
+
+    pensum, schedule = await asyncio.gather(
+        backend_service.get_pensum(jwt),
+        backend_service.get_schedule(jwt, schedule_id),
+    )
+    index = get_index(pensum)
+    enrolled = index.enrolled_groups(schedule)
+
+    if group_code:
+        result = index.check_group(str(group_code), enrolled)
+        if "subject_code" in result:
+            result.update(index.check_requisites(result["subject_code"]))
+        return result
+
+    subject = index.subjects.get(str(subject_code))
+    if subject is None:
+        return {"subject_code": subject_code, "error": "Materia no encontrada en el pensum"}
+
+    groups = [index.check_group(code, enrolled) for code in subject["groups"]]
+    return {
+        "subject_code": subject["code"],
+        "name": subject["name"],
+        **index.check_requisites(subject["code"]),
+        "compatible_groups": [g["group_code"] for g in groups if g.get("compatible")],
+        "groups": groups,
+    }
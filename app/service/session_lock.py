@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Callable, Optional
+
+from app.config import get_settings
+from .metrics import SESSION_LOCK_EVENTS, SESSION_LOCK_WAIT_SECONDS
+from .redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+# Espera entre intentos de tomar un lease ocupado (crece hasta el máximo)
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+
+class SessionBusyError(Exception):
+    """La sesión ya tiene un turno en curso (política reject o espera agotada)"""
+
+
+class SessionLease:
+    """
+    Lease de un turno sobre una sesión, guardado en Redis para que valga entre workers.
+    Mientras se tiene se renueva en segundo plano; si el proceso muere expira solo.
+    """
+
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+        self._refresher: Optional[asyncio.Task] = None
+
+    @property
+    def ttl_ms(self) -> int:
+        return int(get_settings().session_lock_ttl * 1000)
+
+    async def try_acquire(self) -> bool:
+        if not self.acquired:
+            self.acquired = await redis_service.acquire_session_lock(self.session_id, self.token, self.ttl_ms)
+            if self.acquired:
+                self._start_refresher()
+        return self.acquired
+
+    async def acquire(self, timeout: Optional[float] = None, on_wait: Optional[Callable[[], None]] = None):
+        """
+        Esperar el lease; SessionBusyError si no se libera dentro de `timeout`.
+        `on_wait` se llama una vez si hay que hacer cola.
+        """
+        if await self.try_acquire():
+            SESSION_LOCK_EVENTS.labels(outcome="acquired").inc()
+            return
+        if on_wait is not None:
+            on_wait()
+
+        timeout = get_settings().session_lock_wait_timeout if timeout is None else timeout
+        start = time.monotonic()
+        interval = POLL_INTERVAL
+        while time.monotonic() - start < timeout:
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+            if await self.try_acquire():
+                SESSION_LOCK_EVENTS.labels(outcome="waited").inc()
+                SESSION_LOCK_WAIT_SECONDS.observe(time.monotonic() - start)
+                return
+
+        SESSION_LOCK_EVENTS.labels(outcome="timeout").inc()
+        raise SessionBusyError(f"La sesión {self.session_id} sigue ocupada con otro mensaje")
+
+    def _start_refresher(self):
+        async def refresh():
+            while True:
+                await asyncio.sleep(get_settings().session_lock_ttl / 3)
+                try:
+                    if not await redis_service.refresh_session_lock(self.session_id, self.token, self.ttl_ms):
+                        SESSION_LOCK_EVENTS.labels(outcome="lost").inc()
+                        logger.warning("Se perdió el lease de la sesión %s", self.session_id)
+                        return
+                except Exception as e:
+                    logger.warning("No se pudo renovar el lease de la sesión %s: %s", self.session_id, e)
+
+        self._refresher = asyncio.create_task(refresh())
+
+    async def release(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+        if self.acquired:
+            self.acquired = False
+            try:
+                await redis_service.release_session_lock(self.session_id, self.token)
+            except Exception as e:
+                # Si Redis no responde el lease expira solo
+                logger.warning("No se pudo liberar el lease de la sesión %s: %s", self.session_id, e)
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from typing import Dict, List, Set
+
+from app.config import get_settings
+from .redis_service import redis_service
+from .chat import gemini_runtime
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Eres el encargado de mantener el resumen de una conversación entre un estudiante y un asistente de horarios universitarios.
+Actualiza el resumen existente incorporando los mensajes nuevos. Conserva datos concretos: materias, códigos de grupo,
+cambios hechos al horario, preferencias y restricciones del estudiante y preguntas pendientes. Responde solo con el resumen.
+
+Resumen actual:
+{summary}
+
+Mensajes nuevos:
+{messages}
+"""
+
+
+class SummaryService:
+    """
+    Resumen acumulado (rolling summary) de los mensajes que ya no caben en la ventana del modelo.
+    Se construye de forma incremental y en segundo plano: cada pliegue agrega solo los
+    mensajes entre el final del resumen anterior y el inicio de la ventana visible.
+    """
+
+    def __init__(self):
+        self._folding: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule_fold(self, session_id: int, summary: Dict, end: int):
+        """Programar el pliegue de los mensajes [summary.covered, end) sin bloquear el turno"""
+        if session_id in self._folding or end <= summary.get("covered", 0):
+            return
+        self._folding.add(session_id)
+        task = asyncio.create_task(self._fold(session_id, summary, end))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, session_id: int, summary: Dict, end: int):
+        covered = summary.get("covered", 0)
+        try:
+            messages = await redis_service.get_history_range(session_id, covered, end)
+            if not messages:
+                return
+            text = await self._summarize(summary.get("summary", ""), messages)
+            stored = await redis_service.set_history_summary(session_id, text, covered + len(messages), expected_covered=covered)
+            if stored:
+                logger.info("Resumen de sesión %s actualizado hasta el mensaje %d", session_id, covered + len(messages))
+        except Exception as e:
+            logger.warning("No se pudo actualizar el resumen de la sesión %s: %s", session_id, e)
+        finally:
+            self._folding.discard(session_id)
+
+    async def _summarize(self, summary: str, messages: List[Dict]) -> str:
+        settings = get_settings()
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        response = await gemini_runtime.client.aio.models.generate_content(
+            model=settings.summary_model_name or settings.model_name,
+            contents=SUMMARY_PROMPT.format(summary=summary or "(vacío)", messages=transcript),
+        )
+        return response.text or summary
+
+
+summary_service = SummaryService()
@@ -0,0 +1,18 @@
+from typing import Dict, Iterable
+
+# Aproximación para texto en español/inglés con el tokenizador de Gemini (~4 caracteres por token)
+CHARS_PER_TOKEN = 4
+# Costo fijo aproximado por mensaje (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimar tokens de un texto sin llamar a la API (count_tokens)"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(messages: Iterable[Dict]) -> int:
+    """Estimar tokens de una lista de mensajes {"role", "content"}"""
+    return sum(estimate_tokens(msg.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
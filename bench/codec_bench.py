@@ -0,0 +1,165 @@
+"""
+Microbenchmark del codec de almacenamiento: tiempo de encode/decode y bytes guardados
+por sesión para cada combinación de encoder JSON y compresión.
+
+    python -m bench.codec_bench --sessions 200 --turns 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+from app.service import codec as codec_module  # noqa: E402
+from app.service.codec import Codec, sse_event  # noqa: E402
+
+QUESTIONS = [
+    "¿Qué grupos de Cálculo Diferencial no se cruzan con mi horario actual?",
+    "Quiero cambiar el grupo de Programación Orientada a Objetos al de la tarde, ¿se puede?",
+    "¿Cuáles materias me faltan para poder inscribir Estructuras de Datos el próximo semestre?",
+    "Te pego mi horario para que lo revises:",
+]
+ANSWERS = [
+    "Revisé tu horario y el grupo B de Cálculo Diferencial (martes y jueves de 10:00 a 12:00) no tiene cruces. "
+    "El grupo A se cruza con Física Mecánica el lunes a las 08:00.",
+    "Sí, el grupo C de Programación Orientada a Objetos es compatible: quedaría los miércoles y viernes de 14:00 a 16:00. "
+    "¿Quieres que haga el cambio?",
+    "Para inscribir Estructuras de Datos necesitas haber aprobado Programación Orientada a Objetos y Matemáticas Discretas; "
+    "según tu pensum te falta Matemáticas Discretas.",
+]
+DAYS = ["LUNES", "MARTES", "MIÉRCOLES", "JUEVES", "VIERNES", "SÁBADO"]
+
+
+def pasted_table(rng: random.Random) -> str:
+    rows = ["Código | Materia | Grupo | Día | Hora | Salón | Docente"]
+    for i in range(rng.randint(5, 9)):
+        begin = 6 + 2 * rng.randrange(7)
+        rows.append(
+            f"115{rng.randrange(1000):04d} | Materia número {i} | {chr(65 + rng.randrange(4))} | {rng.choice(DAYS)} | "
+            f"{begin:02d}:00-{begin + 2:02d}:00 | SA{rng.randrange(400)} | Docente {rng.randrange(60)}"
+        )
+    return "\n".join(rows)
+
+
+def build_session(rng: random.Random, turns: int) -> List[Dict[str, Any]]:
+    messages = []
+    for _ in range(turns):
+        question = rng.choice(QUESTIONS)
+        if question.endswith(":"):
+            question += "\n" + pasted_table(rng)
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "model", "content": rng.choice(ANSWERS)})
+    return messages
+
+
+def run_case(sessions: List[List[Dict[str, Any]]], use_orjson: bool, compression: str, threshold: int, level: int) -> Optional[Dict[str, Any]]:
+    saved_orjson = codec_module.orjson
+    if use_orjson and saved_orjson is None:
+        return None
+    if compression == "zstd" and codec_module.zstandard is None:
+        return None
+    codec_module.orjson = saved_orjson if use_orjson else None
+    try:
+        codec = Codec(compression=compression, threshold=threshold, level=level)
+        start = time.perf_counter()
+        encoded = [[codec.encode(entry) for entry in session] for session in sessions]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for session in encoded:
+            for raw in session:
+                codec.decode(raw)
+        decode_time = time.perf_counter() - start
+    finally:
+        codec_module.orjson = saved_orjson
+
+    messages = sum(len(session) for session in sessions)
+    stored = sum(len(raw) for session in encoded for raw in session)
+    return {
+        "encoder": "orjson" if use_orjson else "json",
+        "compression": compression,
+        "encode_us_per_message": round(encode_time / messages * 1e6, 2),
+        "decode_us_per_message": round(decode_time / messages * 1e6, 2),
+        "bytes_per_session": round(stored / len(sessions)),
+    }
+
+
+def legacy_case(sessions: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Formato anterior: json.dumps con los valores por defecto"""
+    start = time.perf_counter()
+    encoded = [[json.dumps(entry) for entry in session] for session in sessions]
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for session in encoded:
+        for raw in session:
+            json.loads(raw)
+    decode_time = time.perf_counter() - start
+    messages = sum(len(session) for session in sessions)
+    return {
+        "encoder": "json (anterior)",
+        "compression": "none",
+        "encode_us_per_message": round(encode_time / messages * 1e6, 2),
+        "decode_us_per_message": round(decode_time / messages * 1e6, 2),
+        "bytes_per_session": round(sum(len(raw.encode("utf-8")) for s in encoded for raw in s) / len(sessions)),
+    }
+
+
+def sse_case(events: int) -> Dict[str, float]:
+    event = {"type": "delta", "content": "El grupo B de Cálculo no se cruza ", "trace_id": "0123456789abcdef"}
+    start = time.perf_counter()
+    for _ in range(events):
+        f"data: {json.dumps(event)}\n\n".encode("utf-8")
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(events):
+        sse_event(event)
+    current = time.perf_counter() - start
+    return {
+        "fstring_json_us_per_event": round(legacy / events * 1e6, 3),
+        "sse_event_us_per_event": round(current / events * 1e6, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--threshold", type=int, default=256)
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Guardar los resultados como JSON")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(42)
+    sessions = [build_session(rng, args.turns) for _ in range(args.sessions)]
+
+    cases = [legacy_case(sessions)]
+    for use_orjson in (False, True):
+        for compression in ("none", "zlib", "zstd"):
+            result = run_case(sessions, use_orjson, compression, args.threshold, args.level)
+            if result is not None:
+                cases.append(result)
+
+    print(f"{'encoder':<16} {'compresión':<10} {'encode µs/msg':>14} {'decode µs/msg':>14} {'bytes/sesión':>13}")
+    for case in cases:
+        print(
+            f"{case['encoder']:<16} {case['compression']:<10} {case['encode_us_per_message']:>14} "
+            f"{case['decode_us_per_message']:>14} {case['bytes_per_session']:>13}"
+        )
+    sse = sse_case(20000)
+    print(f"\nSSE: f-string + json.dumps {sse['fstring_json_us_per_event']} µs/evento, sse_event {sse['sse_event_us_per_event']} µs/evento")
+
+    report = {"config": vars(args), "cases": cases, "sse": sse}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == "__main__":
+    main()
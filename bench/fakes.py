@@ -0,0 +1,240 @@
+"""
+Dobles de prueba para el benchmark: cliente de Gemini con guion, backend de horarios
+local y Redis en memoria. Nada de esto se importa desde `app`.
+"""
+import asyncio
+import base64
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from google.genai import errors, types
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+DAYS = ["LUNES", "MARTES", "MIERCOLES", "JUEVES", "VIERNES", "SABADO"]
+
+
+@dataclass
+class ModelProfile:
+    """Comportamiento simulado del modelo en cada turno"""
+    # Rondas de function calls antes de la respuesta final
+    tool_rounds: int = 1
+    # Herramientas que se piden en cada ronda (todas en la misma respuesta)
+    tools: List[str] = field(default_factory=lambda: ["get_pensum", "get_schedule"])
+    # Latencia hasta la primera parte de cada respuesta del modelo
+    first_chunk_delay: float = 0.3
+    # Latencia entre chunks del streaming
+    chunk_delay: float = 0.02
+    chunks: int = 20
+    words_per_chunk: int = 6
+    # Fracción de rondas que tardan `slow_delay` segundos más (cola larga, para probar el hedging)
+    slow_rate: float = 0.0
+    slow_delay: float = 5.0
+    # Fracción de rondas de `overloaded_model` que fallan con 503 (para probar el modelo de respaldo)
+    overload_rate: float = 0.0
+    overloaded_model: Optional[str] = None
+
+
+def make_jwt(user: str) -> str:
+    """
+    JWT sin firma válida (el backend falso no la verifica). Es determinista: el mismo `user`
+    da el mismo token y por lo tanto la misma identidad (`get_user_id` es el hash del token)
+    """
+    def encode(data: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode({'sub': user})}.bench"
+
+
+def _usage(prompt_tokens: int, candidates_tokens: int) -> types.GenerateContentResponseUsageMetadata:
+    return types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=prompt_tokens,
+        candidates_token_count=candidates_tokens,
+        total_token_count=prompt_tokens + candidates_tokens,
+    )
+
+
+def _response(parts: List[types.Part], usage=None) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+        usage_metadata=usage,
+    )
+
+
+class FakeAsyncChat:
+    """Chat con guion: `tool_rounds` rondas de function calls y luego texto en chunks"""
+
+    def __init__(self, profile: ModelProfile, history: List[Any], model: Optional[str] = None):
+        self.profile = profile
+        self.model = model
+        self.history = list(history or [])
+
+    def get_history(self) -> List[Any]:
+        return list(self.history)
+
+    def _function_calls(self) -> List[types.Part]:
+        parts = []
+        for name in self.profile.tools:
+            args: Dict[str, Any] = {}
+            if name == "check_schedule_options":
+                args = {"subject_code": f"{1000 + random.randrange(10)}"}
+            parts.append(types.Part(function_call=types.FunctionCall(name=name, args=args)))
+        return parts
+
+    def _text_chunks(self) -> List[str]:
+        words = self.profile.words_per_chunk
+        return [" ".join(["horario"] * words) + " " for _ in range(self.profile.chunks)]
+
+    def _is_tool_round(self, message: Any) -> bool:
+        # Rondas de herramientas ya hechas desde el último mensaje del usuario (el historial
+        # se deriva solo de `history` para que un chat copiado con get_history siga igual)
+        done = 0
+        for entry in reversed(self.history + [message]):
+            if isinstance(entry, str):
+                break
+            done += 1
+        return done < self.profile.tool_rounds
+
+    async def _first_chunk(self):
+        """Latencia hasta la primera parte; lanza 503 como el API cuando el modelo está sobrecargado"""
+        profile = self.profile
+        delay = profile.first_chunk_delay
+        if profile.slow_rate and random.random() < profile.slow_rate:
+            delay += profile.slow_delay
+        await asyncio.sleep(delay)
+        if profile.overload_rate and self.model == profile.overloaded_model and random.random() < profile.overload_rate:
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}})
+
+    async def send_message(self, message: Any, config=None) -> types.GenerateContentResponse:
+        tool_round = self._is_tool_round(message)
+        await self._first_chunk()
+        if tool_round:
+            response = _response(self._function_calls(), _usage(800, 20))
+        else:
+            await asyncio.sleep(self.profile.chunk_delay * self.profile.chunks)
+            text = "".join(self._text_chunks())
+            response = _response([types.Part(text=text)], _usage(900, len(text) // 4))
+        # Como el SDK: el turno entra al historial solo cuando la respuesta llegó
+        self.history.append(message)
+        return response
+
+    async def send_message_stream(self, message: Any, config=None):
+        tool_round = self._is_tool_round(message)
+
+        async def stream():
+            await self._first_chunk()
+            if tool_round:
+                yield _response(self._function_calls(), _usage(800, 20))
+            else:
+                chunks = self._text_chunks()
+                for i, chunk in enumerate(chunks):
+                    if i:
+                        await asyncio.sleep(self.profile.chunk_delay)
+                    last = i == len(chunks) - 1
+                    yield _response([types.Part(text=chunk)], _usage(900, len(chunk) * len(chunks) // 4) if last else None)
+            self.history.append(message)
+
+        return stream()
+
+
+class FakeAsyncChats:
+    def __init__(self, profile: ModelProfile):
+        self.profile = profile
+
+    def create(self, model=None, config=None, history=None):
+        return FakeAsyncChat(self.profile, history, model)
+
+
+class FakeAsyncModels:
+    """Solo lo usa el resumen en segundo plano"""
+
+    def __init__(self, profile: ModelProfile):
+        self.profile = profile
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        await asyncio.sleep(self.profile.first_chunk_delay)
+        return _response([types.Part(text="Resumen de la conversación del benchmark.")], _usage(1500, 40))
+
+
+class FakeAsyncCaches:
+    async def create(self, model=None, config=None):
+        raise RuntimeError("Context caching no disponible en el benchmark")
+
+    async def update(self, name=None, config=None):
+        raise RuntimeError("Context caching no disponible en el benchmark")
+
+    async def delete(self, name=None, config=None):
+        return None
+
+
+class FakeAio:
+    def __init__(self, profile: ModelProfile):
+        self.chats = FakeAsyncChats(profile)
+        self.models = FakeAsyncModels(profile)
+        self.caches = FakeAsyncCaches()
+
+
+class FakeGenaiClient:
+    """Reemplazo de `google.genai.Client` (solo la API asíncrona que usa la app)"""
+
+    profile = ModelProfile()
+
+    def __init__(self, **kwargs):
+        self.aio = FakeAio(self.profile)
+
+
+def build_pensum(subjects: int, groups_per_subject: int = 3) -> Dict[str, Any]:
+    """Pensum sintético con la forma que espera `schedule_engine` (grupos con sesiones semanales)"""
+    rng = random.Random(subjects)
+    semesters: Dict[int, List[Dict[str, Any]]] = {}
+    for i in range(subjects):
+        code = str(1000 + i)
+        groups = []
+        for g in range(groups_per_subject):
+            begin = 6 + 2 * rng.randrange(7)
+            groups.append({
+                "code": f"{code}-{chr(65 + g)}",
+                "teacher": {"name": f"Docente {rng.randrange(40)}", "department": "Sistemas"},
+                "sessions": [
+                    {"day": day, "beginHour": f"{begin:02d}:00", "endHour": f"{begin + 2:02d}:00", "classroom": f"SA{rng.randrange(400)}"}
+                    for day in rng.sample(DAYS, 2)
+                ],
+                "createdAt": "2024-01-01T00:00:00Z",
+            })
+        semesters.setdefault(i % 10 + 1, []).append({
+            "code": code,
+            "name": f"Materia {code}",
+            "credits": 3,
+            "requisites": [str(1000 + i - 10)] if i >= 10 else [],
+            "status": "APPROVED" if i < subjects // 3 else "PENDING",
+            "groups": groups,
+            "description": "Descripción larga de la materia " * 4,
+        })
+    return {"semesters": [{"number": n, "subjects": s} for n, s in sorted(semesters.items())]}
+
+
+def build_backend_app(latency: float, subjects: int) -> Starlette:
+    """Backend de horarios local con latencia configurable"""
+    pensum = build_pensum(subjects)
+    first_groups = [s["groups"][0] for sem in pensum["semesters"] for s in sem["subjects"]][:5]
+
+    async def get_pensum(request: Request):
+        await asyncio.sleep(latency)
+        return JSONResponse(pensum)
+
+    async def get_schedule(request: Request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"id": int(request.path_params["schedule_id"]), "groups": first_groups})
+
+    async def change_group(request: Request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"ok": True, "group": request.path_params["group_code"]})
+
+    return Starlette(routes=[
+        Route("/pensum", get_pensum, methods=["GET"]),
+        Route("/schedule/{schedule_id:int}", get_schedule, methods=["GET"]),
+        Route("/schedule/{schedule_id:int}/group/{group_code}", change_group, methods=["POST", "PUT", "DELETE"]),
+    ])
@@ -0,0 +1,374 @@
+"""
+Benchmark de carga sin consumir cuota: levanta la app con un cliente de Gemini falso,
+un backend de horarios local y fakeredis (o un Redis real con --redis-url), y mide
+/chat/message y /chat/stream a la concurrencia indicada.
+
+    pip install -r requirements-bench.txt
+    python -m bench.load_test --concurrency 20 --requests 400 --endpoint mixed
+    python -m bench.load_test --compare bench/results/<anterior>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fakes import FakeGenaiClient, ModelProfile, build_backend_app, make_jwt  # noqa: E402
+
+PERCENTILES = (50, 95, 99)
+MODEL_FAMILIES = {
+    "chat_model_rounds": "rounds",
+    "chat_model_hedges": "hedges",
+    "chat_model_fallbacks": "fallbacks",
+    "chat_model_timeouts": "timeouts",
+}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=["message", "stream", "mixed"], default="mixed")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="Total de turnos medidos")
+    parser.add_argument("--warmup", type=int, default=10, help="Turnos previos que no se miden")
+    parser.add_argument("--sessions", type=int, default=0, help="Sesiones distintas (0 = una por worker)")
+    parser.add_argument("--tool-rounds", type=int, default=1)
+    parser.add_argument("--tools", default="get_pensum,get_schedule", help="Herramientas pedidas en cada ronda")
+    parser.add_argument("--model-latency", type=float, default=0.3, help="Segundos hasta el primer chunk del modelo")
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de rondas lentas del modelo (cola larga)")
+    parser.add_argument("--slow-delay", type=float, default=5.0, help="Segundos extra de una ronda lenta")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Fracción de rondas del modelo principal que fallan con 503")
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--backend-latency", type=float, default=0.05)
+    parser.add_argument("--pensum-subjects", type=int, default=60)
+    parser.add_argument("--redis-url", default=None, help="Usar un Redis real en lugar de fakeredis")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados (por defecto bench/results/)")
+    parser.add_argument("--compare", default=None, help="JSON de una corrida anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {"count": len(values)}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary[f"p{p}"] = round(value * 1000, 2) if value is not None else None
+    summary["mean"] = round(sum(values) / len(values) * 1000, 2) if values else None
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def configure_environment(args: argparse.Namespace, backend_port: int):
+    """Variables leídas por `Settings`; deben existir antes de importar la app"""
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ["CHAT_ACTIVE"] = "true"
+    os.environ["BACKEND_URL"] = f"http://127.0.0.1:{backend_port}/"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Los usuarios simulados envían mucho más rápido que uno real: sin límite de tasa salvo que se pida
+    os.environ.setdefault("USER_RATE_LIMIT_PER_MINUTE", "0")
+    os.environ.setdefault("PROCESS_RATE_LIMIT_PER_SECOND", "0")
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+
+
+class ServerThread(threading.Thread):
+    """App y backend falso en su propio event loop, separados del generador de carga"""
+
+    def __init__(self, args: argparse.Namespace, app_port: int, backend_port: int):
+        super().__init__(daemon=True)
+        self.args = args
+        self.app_port = app_port
+        self.backend_port = backend_port
+        self.ready = threading.Event()
+        self.servers: List[uvicorn.Server] = []
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except BaseException as e:
+            self.error = e
+            self.ready.set()
+
+    async def _serve(self):
+        from app.main import app
+
+        if not self.args.redis_url:
+            import fakeredis
+            from app.service.redis_service import redis_service
+            client = fakeredis.FakeAsyncRedis(decode_responses=False)
+            redis_service.client = client
+            redis_service.pool = client.connection_pool
+
+        backend = build_backend_app(self.args.backend_latency, self.args.pensum_subjects)
+        for target, port in ((app, self.app_port), (backend, self.backend_port)):
+            config = uvicorn.Config(target, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+            self.servers.append(uvicorn.Server(config))
+
+        tasks = [asyncio.create_task(server.serve()) for server in self.servers]
+        while not all(server.started for server in self.servers):
+            if any(task.done() for task in tasks):
+                break
+            await asyncio.sleep(0.01)
+        self.ready.set()
+        await asyncio.gather(*tasks)
+
+    def stop(self):
+        for server in self.servers:
+            server.should_exit = True
+        self.join(timeout=10)
+
+
+def scrape_metrics(text: str) -> Dict[str, Dict[str, float]]:
+    """Sumas y conteos de los histogramas por etapa/herramienta, y contadores de tokens y del modelo"""
+    values: Dict[str, Dict[str, float]] = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if family.name == "chat_stage_seconds" and sample.name.endswith(("_sum", "_count")):
+                key = f"stage:{sample.labels['stage']}"
+            elif family.name == "chat_tool_call_seconds" and sample.name.endswith(("_sum", "_count")):
+                key = f"tool:{sample.labels['tool']}:{sample.labels['status']}"
+            elif family.name == "gemini_tokens" and sample.name.endswith("_total"):
+                values.setdefault("tokens", {})[sample.labels["kind"]] = sample.value
+                continue
+            elif family.name in MODEL_FAMILIES and sample.name.endswith("_total"):
+                # rounds:<modelo>, hedges:<outcome>, fallbacks:<motivo>, timeouts:<alcance>
+                label = next(iter(sample.labels.values()))
+                values.setdefault("model", {})[f"{MODEL_FAMILIES[family.name]}:{label}"] = sample.value
+                continue
+            else:
+                continue
+            values.setdefault(key, {})[sample.name.rsplit("_", 1)[1]] = sample.value
+    return values
+
+
+def metrics_delta(before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    breakdown: Dict[str, Any] = {"stages": {}, "tools": {}, "tokens": {}, "model": {}}
+    for key, sample in after.items():
+        previous = before.get(key, {})
+        if key in ("tokens", "model"):
+            breakdown[key] = {kind: value - previous.get(kind, 0) for kind, value in sample.items()}
+            continue
+        count = sample.get("count", 0) - previous.get("count", 0)
+        total = sample.get("sum", 0) - previous.get("sum", 0)
+        if count <= 0:
+            continue
+        kind, name = key.split(":", 1)
+        breakdown["stages" if kind == "stage" else "tools"][name] = {
+            "count": int(count),
+            "mean_ms": round(total / count * 1000, 2),
+            "total_s": round(total, 3),
+        }
+    return breakdown
+
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.samples: Dict[str, List[Dict[str, float]]] = {"message": [], "stream": []}
+        self.errors: Dict[str, int] = {"message": 0, "stream": 0}
+        self.record = False
+        self._counter = 0
+
+    def _next_endpoint(self) -> str:
+        self._counter += 1
+        if self.args.endpoint == "mixed":
+            return "stream" if self._counter % 2 else "message"
+        return self.args.endpoint
+
+    async def _turn(self, client: httpx.AsyncClient, session_id: int, jwt: str, text: str):
+        endpoint = self._next_endpoint()
+        headers = {"Authorization": f"Bearer {jwt}", "X-Cache-Bypass": "1"}
+        payload = {"session_id": session_id, "message": text}
+        start = time.perf_counter()
+        sample: Dict[str, float] = {}
+        ok = True
+        try:
+            if endpoint == "message":
+                response = await client.post("/chat/message", json=payload, headers=headers)
+                ok = response.status_code == 200
+            else:
+                async with client.stream("POST", "/chat/stream", json=payload, headers=headers) as response:
+                    ok = response.status_code == 200
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        now = time.perf_counter() - start
+                        sample.setdefault("first_event", now)
+                        event = json.loads(line[6:])
+                        if event.get("type") == "delta":
+                            sample.setdefault("first_token", now)
+                        elif event.get("type") == "error":
+                            ok = False
+        except httpx.HTTPError:
+            ok = False
+        sample["latency"] = time.perf_counter() - start
+
+        if not self.record:
+            return
+        if ok:
+            self.samples[endpoint].append(sample)
+        else:
+            self.errors[endpoint] += 1
+
+    async def _worker(self, client: httpx.AsyncClient, worker: int, turns: "asyncio.Queue[int]"):
+        sessions = self.args.sessions or self.args.concurrency
+        session_id = 900000 + worker % sessions
+        jwt = make_jwt(f"bench-user-{worker % sessions}")
+        while True:
+            try:
+                n = turns.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._turn(client, session_id, jwt, f"¿Qué grupos de la materia {1000 + n % 50} me sirven?")
+
+    async def _phase(self, client: httpx.AsyncClient, total: int) -> float:
+        turns: "asyncio.Queue[int]" = asyncio.Queue()
+        for n in range(total):
+            turns.put_nowait(n)
+        start = time.perf_counter()
+        await asyncio.gather(*[self._worker(client, w, turns) for w in range(self.args.concurrency)])
+        return time.perf_counter() - start
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2, max_keepalive_connections=self.args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=120) as client:
+            if self.args.warmup:
+                await self._phase(client, self.args.warmup)
+
+            before = scrape_metrics((await client.get("/metrics")).text)
+            self.record = True
+            elapsed = await self._phase(client, self.args.requests)
+            self.record = False
+            after = scrape_metrics((await client.get("/metrics")).text)
+
+        completed = sum(len(samples) for samples in self.samples.values())
+        results: Dict[str, Any] = {
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_second": round(completed / elapsed, 2) if elapsed else None,
+            "errors": self.errors,
+            "endpoints": {},
+            "breakdown": metrics_delta(before, after),
+        }
+        for endpoint, samples in self.samples.items():
+            if not samples and not self.errors[endpoint]:
+                continue
+            entry = {"latency_ms": summarize([s["latency"] for s in samples])}
+            if endpoint == "stream":
+                entry["first_event_ms"] = summarize([s["first_event"] for s in samples if "first_event" in s])
+                entry["first_token_ms"] = summarize([s["first_token"] for s in samples if "first_token" in s])
+            results["endpoints"][endpoint] = entry
+        return results
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"\nCommit {results['commit']}  |  {results['results']['requests_per_second']} req/s  |  errores {results['results']['errors']}")
+    for endpoint, entry in results["results"]["endpoints"].items():
+        for metric, summary in entry.items():
+            line = f"  {endpoint:<8} {metric:<15} " + "  ".join(f"p{p}={summary[f'p{p}']}ms" for p in PERCENTILES)
+            previous = (baseline or {}).get("results", {}).get("endpoints", {}).get(endpoint, {}).get(metric)
+            if previous:
+                line += "   vs base: " + "  ".join(
+                    f"p{p} {summary[f'p{p}'] - previous[f'p{p}']:+.1f}ms"
+                    for p in PERCENTILES
+                    if summary[f"p{p}"] is not None and previous.get(f"p{p}") is not None
+                )
+            print(line)
+    print("  Etapas (media por llamada):")
+    for name, stage in results["results"]["breakdown"]["stages"].items():
+        print(f"    {name:<15} {stage['mean_ms']:>8.2f}ms  x{stage['count']}")
+    for name, tool in results["results"]["breakdown"]["tools"].items():
+        print(f"    {name:<30} {tool['mean_ms']:>8.2f}ms  x{tool['count']}")
+    model = {key: int(value) for key, value in results["results"]["breakdown"].get("model", {}).items() if value}
+    if model:
+        print("  Modelo: " + ", ".join(f"{key}={value}" for key, value in sorted(model.items())))
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    app_port, backend_port = free_port(), free_port()
+    configure_environment(args, backend_port)
+
+    import google.genai as genai
+    from app.config import get_settings
+    FakeGenaiClient.profile = ModelProfile(
+        tool_rounds=args.tool_rounds,
+        tools=[tool for tool in args.tools.split(",") if tool],
+        first_chunk_delay=args.model_latency,
+        chunk_delay=args.chunk_delay,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay,
+        overload_rate=args.overload_rate,
+        overloaded_model=get_settings().model_name,
+        chunks=args.chunks,
+    )
+    genai.Client = FakeGenaiClient
+
+    server = ServerThread(args, app_port, backend_port)
+    server.start()
+    server.ready.wait()
+    if server.error:
+        raise server.error
+
+    try:
+        results = asyncio.run(LoadGenerator(args, f"http://127.0.0.1:{app_port}").run())
+    finally:
+        server.stop()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+
+    output = args.output or os.path.join(
+        ROOT, "bench", "results", f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"\nResultados guardados en {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Presupuesto de arranque: mide en procesos nuevos el tiempo de `import app.main` y del
+warmup del lifespan (con fakeredis y un backend mínimo) y falla si alguno supera su límite.
+También verifica que importar la app no cargue google-genai (se importa en el warmup).
+
+    python -m bench.startup_budget --import-budget 1.5 --warmup-budget 4 --runs 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+print(json.dumps({
+    "import_seconds": time.perf_counter() - start,
+    "genai_loaded": "google.genai.types" in sys.modules,
+}))
+"""
+
+WARMUP_PROBE = """
+import asyncio, json, time
+import fakeredis, uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from app.main import app, lifespan
+from app.service.redis_service import redis_service
+from app.service.readiness import readiness_service
+
+client = fakeredis.FakeAsyncRedis(decode_responses=False)
+redis_service.client = client
+redis_service.pool = client.connection_pool
+
+async def main():
+    backend = uvicorn.Server(uvicorn.Config(Starlette(routes=[Route("/", lambda request: JSONResponse({{}}))]), host="127.0.0.1", port={port}, log_level="warning"))
+    task = asyncio.create_task(backend.serve())
+    while not backend.started:
+        await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    async with lifespan(app):
+        startup = time.perf_counter() - start
+        ready = await readiness_service.check()
+    backend.should_exit = True
+    await task
+    print(json.dumps({{"warmup_seconds": startup, "ready": ready["ready"]}}))
+
+asyncio.run(main())
+"""
+
+
+def run_probe(code: str, env: Dict[str, str]) -> Dict[str, Any]:
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-budget", type=float, default=1.5, help="Segundos máximos para importar app.main")
+    parser.add_argument("--warmup-budget", type=float, default=4.0, help="Segundos máximos del lifespan hasta estar listo")
+    parser.add_argument("--runs", type=int, default=3, help="Se toma la mediana de varias corridas")
+    args = parser.parse_args(argv)
+
+    from bench.load_test import free_port
+
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench"),
+        "LOG_LEVEL": "WARNING",
+        "PYTHONPATH": ROOT,
+    }
+    imports, warmups = [], []
+    failures: List[str] = []
+    for _ in range(args.runs):
+        probe = run_probe(IMPORT_PROBE, env)
+        imports.append(probe["import_seconds"])
+        if probe["genai_loaded"]:
+            failures.append("importar app.main cargó google.genai (debe cargarse en el warmup)")
+
+        port = free_port()
+        probe = run_probe(WARMUP_PROBE.format(port=port), {**env, "BACKEND_URL": f"http://127.0.0.1:{port}/"})
+        warmups.append(probe["warmup_seconds"])
+        if not probe["ready"]:
+            failures.append("/ready no quedó listo después del warmup")
+
+    import_seconds = sorted(imports)[len(imports) // 2]
+    warmup_seconds = sorted(warmups)[len(warmups) // 2]
+    print(f"import app.main: {import_seconds:.3f} s (límite {args.import_budget} s)")
+    print(f"warmup:          {warmup_seconds:.3f} s (límite {args.warmup_budget} s)")
+    if import_seconds > args.import_budget:
+        failures.append(f"import de {import_seconds:.3f} s supera el presupuesto de {args.import_budget} s")
+    if warmup_seconds > args.warmup_budget:
+        failures.append(f"warmup de {warmup_seconds:.3f} s supera el presupuesto de {args.warmup_budget} s")
+
+    for failure in sorted(set(failures)):
+        print(f"FALLA: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())